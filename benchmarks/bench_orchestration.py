@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+import os, sys, json, struct, random, shutil, tempfile, argparse, contextlib, importlib.util
+
+# Measure the overhead slp-to-mp4 adds around Dolphin and ffmpeg when recording a folder: launching and waiting
+# for Dolphin, copying user dirs, scheduling, muxing and combining. Dolphin, ffmpeg and ffprobe are replaced by the
+# stubs in benchmarks/stubs, which "render" at a fixed, fast rate, so thousands of games run in a minute or two and
+# everything left over is orchestration.
+#
+# Exits with status 1 if a threshold is exceeded, so it can be used to catch regressions. The default thresholds
+# leave about 2x headroom over a default run on a 4 core box, override them on the command line for other machines.
+
+THIS_DIR, _ = os.path.split(os.path.abspath(__file__))
+SLP2MP4_DIR = os.path.join(THIS_DIR, '..', 'slp2mp4')
+STUBS_DIR = os.path.join(THIS_DIR, 'stubs')
+sys.path.insert(0, SLP2MP4_DIR)
+import config
+import slpscanner
+
+SAMPLE_SLP = os.path.join(THIS_DIR, '..', 'tests', 'EvenMatchupGaming-Game_20190519T162734.slp')
+
+MAX_RENDER_OVERHEAD_MS = 400
+MAX_MUX_OVERHEAD_MS = 200
+MAX_IDLE_FRACTION = 0.15
+MAX_WALL_RATIO = 4.0
+MAX_SCAN_MS = 1.0
+
+# Sections write_dolphin_settings() sets options in
+DOLPHIN_INIS = {
+    'GFX.ini': ['Settings', 'Enhancements'],
+    'Dolphin.ini': ['Interface', 'Display', 'Core', 'Movie', 'DSP'],
+}
+
+
+def load_slp_to_mp4():
+    spec = importlib.util.spec_from_file_location('slp_to_mp4', os.path.join(SLP2MP4_DIR, 'slp-to-mp4.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_replay_template(sample):
+    """
+    Returns the sample replay cut down to its event payloads and game start events, and its metadata block
+    The scanner and the stub Dolphin only need these, so synthetic replays are a few hundred bytes each
+    """
+    with open(sample, 'rb') as f:
+        data = f.read()
+    raw_pos = len(slpscanner.RAW_PREFIX) + 4
+    raw_length = struct.unpack('>I', data[len(slpscanner.RAW_PREFIX):raw_pos])[0]
+    payload_sizes, game_start_pos = slpscanner.parse_event_payloads(data[raw_pos:])
+    raw = data[raw_pos:raw_pos + game_start_pos + 1 + payload_sizes[slpscanner.GAME_START]]
+    metadata = data[raw_pos + raw_length:]
+    return raw, metadata
+
+
+def make_replay_set(out_dir, num_replays, games_per_set, min_seconds, max_seconds, seed):
+    """
+    Write num_replays replays with random lengths into subdirectories of games_per_set replays each
+    Returns the total number of frames
+    """
+    raw, metadata = make_replay_template(SAMPLE_SLP)
+    last_frame_pos = metadata.index(b'U\tlastFramel') + len(b'U\tlastFramel')
+    rng = random.Random(seed)
+    total_frames = 0
+    for i in range(num_replays):
+        set_dir = os.path.join(out_dir, 'Set_{:04}'.format(i // games_per_set))
+        os.makedirs(set_dir, exist_ok=True)
+        duration = rng.randint(min_seconds * 60, max_seconds * 60)
+        total_frames += duration
+        last_frame = duration + slpscanner.FIRST_FRAME_INDEX - 1
+        game_metadata = metadata[:last_frame_pos] + struct.pack('>i', last_frame) + metadata[last_frame_pos + 4:]
+        with open(os.path.join(set_dir, 'Game_{:05}.slp'.format(i)), 'wb') as f:
+            f.write(slpscanner.RAW_PREFIX + struct.pack('>I', len(raw)) + raw + game_metadata)
+    return total_frames
+
+
+def make_dolphin_dir(dolphin_dir):
+    """
+    A playback Dolphin dir with the stub Dolphin and just enough of a User dir for slp-to-mp4 to set its options
+    """
+    config_dir = os.path.join(dolphin_dir, 'User', 'Config')
+    os.makedirs(config_dir)
+    os.makedirs(os.path.join(dolphin_dir, 'User', 'GameSettings'))
+    for ini, sections in DOLPHIN_INIS.items():
+        with open(os.path.join(config_dir, ini), 'w') as f:
+            f.writelines('[{}]\n'.format(section) for section in sections)
+    with open(os.path.join(dolphin_dir, 'User', 'GameSettings', 'GALE01.ini'), 'w') as f:
+        f.write('[Gecko_Enabled]\n$Required: Slippi Playback\n')
+    shutil.copy2(os.path.join(STUBS_DIR, 'dolphin-emu'), os.path.join(dolphin_dir, config.DOLPHIN_NAME))
+
+
+def write_config(path, work_dir, args):
+    iso = os.path.join(work_dir, 'SSBM.iso')
+    open(iso, 'w').close()
+    conf = {
+        'melee_iso': iso,
+        'dolphin_dir': os.path.join(work_dir, 'dolphin'),
+        'ffmpeg': os.path.join(STUBS_DIR, 'ffmpeg'),
+        'resolution': '720p',
+        'widescreen': True,
+        'bitrateKbps': 16000,
+        'parallel_games': args.parallel_games,
+        'parallel_encodes': args.parallel_encodes,
+        'persistent_dolphin': args.persistent,
+        'persistent_dolphin_games': args.persistent_games,
+        'remove_short': False,
+        'combine': True,
+        'single_pass_combine': args.single_pass,
+        'stall_seconds': args.stall_seconds,
+        'retry_backoff_seconds': args.retry_backoff_seconds,
+    }
+    with open(path, 'w') as f:
+        json.dump(conf, f)
+
+
+def run_benchmark(slp_to_mp4, work_dir, replay_dir, log_file):
+    """
+    Record replay_dir with everything slp-to-mp4 writes going to work_dir
+    Returns the records from the metrics file
+    """
+    slp_to_mp4.SCRIPT_DIR = work_dir
+    slp_to_mp4.OUT_DIR = os.path.join(work_dir, 'out')
+    slp_to_mp4.INDEX_FILE = os.path.join(work_dir, 'replay_index.db')
+    slp_to_mp4.JOURNAL_FILE = os.path.join(work_dir, 'job_journal.db')
+    slp_to_mp4.METRICS_DIR = os.path.join(work_dir, 'metrics')
+
+    conf = slp_to_mp4.Config()
+    with open(log_file, 'w') as log, contextlib.redirect_stdout(log):
+        slp_to_mp4.record_folder_slp(replay_dir, conf)
+
+    records = []
+    for metrics_file in os.listdir(slp_to_mp4.METRICS_DIR):
+        with open(os.path.join(slp_to_mp4.METRICS_DIR, metrics_file)) as f:
+            records += [json.loads(line) for line in f]
+    return records, conf
+
+
+def analyse(records, slp_to_mp4, conf, args):
+    jobs = [r for r in records if r['type'] == 'job']
+    run = next(r for r in records if r['type'] == 'run')
+    combines = [r for r in records if r['type'] == 'combine']
+    num_renderers = slp_to_mp4.get_num_processes(conf)
+
+    # What the stubs spend per game, i.e. the time a perfect orchestrator would take
+    def stub_render_seconds(job):
+        frames = job['frames'] + slp_to_mp4.DURATION_BUFFER
+        startup = 0 if args.persistent else args.stub_startup
+        return startup + frames / args.stub_fps
+
+    render_overheads = [job.get('render_seconds', 0) - stub_render_seconds(job) for job in jobs]
+    mux_overheads = [job.get('mux_seconds', 0) - args.stub_ffmpeg_seconds for job in jobs]
+    total_stub_seconds = sum(stub_render_seconds(job) for job in jobs)
+
+    # Time between the first game starting and the last one finishing during which a render thread had nothing to do
+    first_start = min(job['start'] for job in jobs)
+    last_end = max(job['start'] + job['wall_seconds'] for job in jobs)
+    render_window = last_end - first_start
+    busy = sum(job.get('render_seconds', 0) for job in jobs)
+    idle_fraction = 1 - busy / (num_renderers * render_window)
+
+    ideal_seconds = total_stub_seconds / num_renderers
+    scan_seconds = sum(r['scan_seconds'] for r in records if r['type'] == 'index')
+    return {
+        'jobs': len(jobs),
+        'failed': run['failed'],
+        'combined': len(combines),
+        'renderers': num_renderers,
+        'wall_seconds': run['wall_seconds'],
+        'ideal_seconds': ideal_seconds,
+        'wall_ratio': run['wall_seconds'] / ideal_seconds,
+        'render_overhead_ms': 1000 * sum(render_overheads) / len(jobs),
+        'mux_overhead_ms': 1000 * sum(mux_overheads) / len(jobs),
+        'first_frame_ms': 1000 * sum(job.get('first_frame_seconds', 0) for job in jobs) / len(jobs),
+        'copy_user_dir_ms': 1000 * sum(job.get('copy_user_dir_seconds', 0) for job in jobs) / len(jobs),
+        'idle_fraction': idle_fraction,
+        'scan_seconds': scan_seconds,
+        'scan_ms': 1000 * scan_seconds / args.replays,
+        'combine_seconds': sum(r['combine_seconds'] for r in combines),
+    }
+
+
+def print_results(results):
+    print("{jobs} games ({failed} failed, {combined} sets combined) on {renderers} render threads".format(**results))
+    print("wall time          {:>10.2f} s   (ideal {:.2f} s, {:.2f}x)".format(
+        results['wall_seconds'], results['ideal_seconds'], results['wall_ratio']))
+    print("render overhead    {:>10.1f} ms/game".format(results['render_overhead_ms']))
+    print("  first frame      {:>10.1f} ms/game".format(results['first_frame_ms']))
+    print("  copy user dir    {:>10.1f} ms/game".format(results['copy_user_dir_ms']))
+    print("mux overhead       {:>10.1f} ms/game".format(results['mux_overhead_ms']))
+    print("render idle        {:>10.1%}".format(results['idle_fraction']))
+    print("index scan         {:>10.2f} s   ({:.3f} ms/replay)".format(results['scan_seconds'], results['scan_ms']))
+    print("combine            {:>10.2f} s".format(results['combine_seconds']))
+
+
+def check_thresholds(results, args):
+    """
+    Returns a list of the thresholds that were exceeded
+    """
+    exceeded = []
+    if results['failed']:
+        exceeded.append("{} games failed".format(results['failed']))
+    checks = [
+        ('render_overhead_ms', args.max_render_overhead_ms, "render overhead {:.1f} ms/game > {} ms"),
+        ('mux_overhead_ms', args.max_mux_overhead_ms, "mux overhead {:.1f} ms/game > {} ms"),
+        ('idle_fraction', args.max_idle_fraction, "render idle fraction {:.3f} > {}"),
+        ('wall_ratio', args.max_wall_ratio, "wall time {:.2f}x ideal > {}x"),
+        ('scan_ms', args.max_scan_ms, "index scan {:.3f} ms/replay > {} ms"),
+    ]
+    for key, limit, message in checks:
+        if limit and results[key] > limit:
+            exceeded.append(message.format(results[key], limit))
+    return exceeded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark slp-to-mp4 orchestration overhead using stub Dolphin and ffmpeg")
+    parser.add_argument('--replays', type=int, default=1000, help="number of synthetic replays")
+    parser.add_argument('--games-per-set', type=int, default=4, help="replays per subdirectory (combined into one video)")
+    parser.add_argument('--min-seconds', type=int, default=30, help="shortest game length")
+    parser.add_argument('--max-seconds', type=int, default=240, help="longest game length")
+    parser.add_argument('--seed', type=int, default=0, help="random seed for game lengths")
+    parser.add_argument('--parallel-games', default='4', help="parallel_games setting")
+    parser.add_argument('--parallel-encodes', type=int, default=2, help="parallel_encodes setting")
+    parser.add_argument('--persistent', action='store_true', help="use persistent Dolphins")
+    parser.add_argument('--single-pass', action='store_true', help="use single pass combine")
+    parser.add_argument('--persistent-games', type=int, default=20, help="persistent_dolphin_games setting")
+    parser.add_argument('--stub-fps', type=float, default=60000, help="frames per second the stub Dolphin renders")
+    parser.add_argument('--stub-startup', type=float, default=0.05, help="seconds the stub Dolphin takes to start")
+    parser.add_argument('--stub-hang-rate', type=float, default=0, help="fraction of games the stub Dolphin hangs on")
+    parser.add_argument('--stall-seconds', type=float, default=60, help="stall_seconds setting")
+    parser.add_argument('--retry-backoff-seconds', type=float, default=10, help="retry_backoff_seconds setting")
+    parser.add_argument('--stub-ffmpeg-seconds', type=float, default=0.01, help="seconds each stub ffmpeg run takes")
+    # A threshold of 0 isn't checked
+    parser.add_argument('--max-render-overhead-ms', type=float, default=MAX_RENDER_OVERHEAD_MS,
+                        help="fail if render overhead per game is above this")
+    parser.add_argument('--max-mux-overhead-ms', type=float, default=MAX_MUX_OVERHEAD_MS,
+                        help="fail if mux overhead per game is above this")
+    parser.add_argument('--max-idle-fraction', type=float, default=MAX_IDLE_FRACTION,
+                        help="fail if render threads are idle more than this")
+    parser.add_argument('--max-wall-ratio', type=float, default=MAX_WALL_RATIO,
+                        help="fail if wall time is more than this times the ideal")
+    parser.add_argument('--max-scan-ms', type=float, default=MAX_SCAN_MS,
+                        help="fail if scanning replays for the index takes more than this per replay")
+    parser.add_argument('--json', help="also write the results to this file")
+    parser.add_argument('--keep', action='store_true', help="keep the working directory")
+    args = parser.parse_args()
+
+    os.environ['STUB_DOLPHIN_FPS'] = str(args.stub_fps)
+    os.environ['STUB_DOLPHIN_STARTUP'] = str(args.stub_startup)
+    os.environ['STUB_DOLPHIN_HANG_RATE'] = str(args.stub_hang_rate)
+    os.environ['STUB_FFMPEG_SECONDS'] = str(args.stub_ffmpeg_seconds)
+
+    work_dir = tempfile.mkdtemp(prefix='bench_orchestration_')
+    try:
+        replay_dir = os.path.join(work_dir, 'replays')
+        total_frames = make_replay_set(replay_dir, args.replays, args.games_per_set,
+                                       args.min_seconds, args.max_seconds, args.seed)
+        print("{} replays, {:.0f} minutes of gameplay".format(args.replays, total_frames / 60 / 60))
+        make_dolphin_dir(os.path.join(work_dir, 'dolphin'))
+        config.THIS_CONFIG = os.path.join(work_dir, 'config.json')
+        write_config(config.THIS_CONFIG, work_dir, args)
+
+        slp_to_mp4 = load_slp_to_mp4()
+        log_file = os.path.join(work_dir, 'slp-to-mp4.log')
+        records, conf = run_benchmark(slp_to_mp4, work_dir, replay_dir, log_file)
+        results = analyse(records, slp_to_mp4, conf, args)
+    finally:
+        if args.keep:
+            print("Working directory: {}".format(work_dir))
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    exceeded = check_thresholds(results, args)
+    for message in exceeded:
+        print("FAIL: {}".format(message))
+    sys.exit(1 if exceeded else 0)
+
+
+if __name__ == '__main__':
+    main()
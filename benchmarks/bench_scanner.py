@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+import os, sys, time, struct, shutil, tempfile, argparse
+
+# Compare slpscanner.scan() against a full slippi.Game() parse
+# py-slippi is optional here - without it only the scanner is timed
+
+THIS_DIR, _ = os.path.split(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(THIS_DIR, '..', 'slp2mp4'))
+import slpscanner
+
+SAMPLE_SLP = os.path.join(THIS_DIR, '..', 'tests', 'EvenMatchupGaming-Game_20190519T162734.slp')
+
+try:
+    from slippi import Game
+except ImportError:
+    Game = None
+
+
+def make_replay_set(sample, out_dir, copies, no_metadata_every):
+    """
+    Write `copies` replays to out_dir. Every `no_metadata_every`th one has its metadata block
+    stripped (like a replay from a crashed dolphin) so the frame counting fallback is exercised too
+    """
+    with open(sample, 'rb') as f:
+        data = f.read()
+    raw_pos = len(slpscanner.RAW_PREFIX) + 4
+    raw_length = struct.unpack('>I', data[len(slpscanner.RAW_PREFIX):raw_pos])[0]
+    no_metadata = data[:len(slpscanner.RAW_PREFIX)] + struct.pack('>I', 0) + data[raw_pos:raw_pos + raw_length]
+
+    files = []
+    for i in range(copies):
+        path = os.path.join(out_dir, 'Game_{:05}.slp'.format(i))
+        with open(path, 'wb') as f:
+            if no_metadata_every and i % no_metadata_every == no_metadata_every - 1:
+                f.write(no_metadata)
+            else:
+                f.write(data)
+        files.append(path)
+    return files
+
+
+def time_parse(name, parse, files, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for slp_file in files:
+            parse(slp_file)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print("{:<10} {:>6} files  {:>10.4f} s  {:>10.3f} ms/file".format(name, len(files), best, 1000 * best / len(files)))
+    return best
+
+
+def scanner_duration(slp_file):
+    return slpscanner.scan(slp_file).duration
+
+
+def game_duration(slp_file):
+    return Game(slp_file).metadata.duration
+
+
+def run(files, repeat):
+    scanner_time = time_parse('scan()', scanner_duration, files, repeat)
+    if Game is None:
+        print("py-slippi not installed, skipping Game()")
+        return
+    game_time = time_parse('Game()', game_duration, files, repeat)
+    print("speedup: {:.1f}x".format(game_time / scanner_time))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark slpscanner against py-slippi Game()")
+    parser.add_argument('--copies', type=int, default=200, help="number of replays in the synthetic set")
+    parser.add_argument('--no-metadata-every', type=int, default=10,
+                        help="strip metadata from every Nth synthetic replay (0 to never)")
+    parser.add_argument('--repeat', type=int, default=3, help="best of N runs")
+    args = parser.parse_args()
+
+    print("Sample replay")
+    run([SAMPLE_SLP], args.repeat)
+
+    if Game is not None:
+        # The scanner has to agree with py-slippi before its timings mean anything
+        assert scanner_duration(SAMPLE_SLP) == game_duration(SAMPLE_SLP)
+
+    tmp_dir = tempfile.mkdtemp(prefix='slp-bench-')
+    try:
+        files = make_replay_set(SAMPLE_SLP, tmp_dir, args.copies, args.no_metadata_every)
+        print("Synthetic set ({} replays, every {}th without metadata)".format(args.copies, args.no_metadata_every))
+        run(files, args.repeat)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import os, sys, builtins, importlib, importlib.abc, importlib.machinery, importlib.util
+
+# The modules in this directory are scripts that import each other by name (import config, from scheduler import
+# Job), which only works with this directory on sys.path. For the Python API they're loaded as slp2mp4._<name>
+# instead, e.g. slp2mp4._scheduler and slp2mp4._slp_to_mp4 for slp-to-mp4.py, and their imports of each other are
+# pointed at those. Nothing is added to sys.path, so the names can't clash with the importing program's modules.
+
+THIS_DIR, _ = os.path.split(os.path.abspath(__file__))
+PRIVATE_PREFIX = __name__ + '._'
+
+
+def script_path(name):
+    """
+    The file of the module called name in this directory, or None if there isn't one
+    """
+    for file_name in (name + '.py', name.replace('_', '-') + '.py'):
+        path = os.path.join(THIS_DIR, file_name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def sibling_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level == 0 and '.' not in name and script_path(name) is not None:
+        return importlib.import_module(PRIVATE_PREFIX + name)
+    return builtins.__import__(name, globals, locals, fromlist, level)
+
+
+SCRIPT_BUILTINS = dict(builtins.__dict__, __import__=sibling_import)
+
+
+class ScriptLoader(importlib.machinery.SourceFileLoader):
+    def exec_module(self, module):
+        module.__builtins__ = SCRIPT_BUILTINS
+        super().exec_module(module)
+
+
+class ScriptFinder(importlib.abc.MetaPathFinder):
+    """
+    Finds slp2mp4._<name>. Also used by multiprocessing children, which import functions by module name
+    """
+    def find_spec(self, fullname, path, target=None):
+        if not fullname.startswith(PRIVATE_PREFIX):
+            return None
+        script = script_path(fullname[len(PRIVATE_PREFIX):])
+        if script is None:
+            return None
+        return importlib.util.spec_from_file_location(fullname, script, loader=ScriptLoader(fullname, script))
+
+
+if not any(isinstance(finder, ScriptFinder) for finder in sys.meta_path):
+    sys.meta_path.append(ScriptFinder())
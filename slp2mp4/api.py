@@ -0,0 +1,203 @@
+import os, queue, threading, contextlib, importlib
+
+# Render replays from Python instead of the command line:
+#
+#     from slp2mp4 import api
+#     with api.render(replay_paths, out_dir='videos', settings={'resolution': '720p'}) as renders:
+#         for result in renders:
+#             print(result.slp_file, result.out_file if result.ok else result.error)
+#
+# replays can be any iterable of paths, including a generator that's still finding them. Each item is a replay path,
+# or a (replay path, mp4 path) pair to choose the output file. Results are yielded as each game finishes, in
+# whatever order they finish in. Games are run by the same pipeline as a folder run (see scheduler.py), but nothing
+# is journaled: a game that's cancelled or fails isn't picked up again by a later run.
+#
+# Importing this module is cheap. slp-to-mp4.py, and psutil with it, is only loaded once render() is called. It's
+# loaded as slp2mp4._slp_to_mp4, with the modules it uses (see __init__.py), so they don't clash with the caller's.
+
+SCRIPT_MODULE = __package__ + '._slp_to_mp4'
+
+
+def load_script():
+    """
+    Import slp-to-mp4.py, it can't be imported the normal way because of the hyphens
+    """
+    return importlib.import_module(SCRIPT_MODULE)
+
+
+class RenderResult:
+    def __init__(self, slp_file, out_file, ok, error=None, recorded=False):
+        self.slp_file = slp_file
+        self.out_file = out_file
+        self.ok = ok                    # False if the game failed, error says why
+        self.error = error
+        self.recorded = recorded        # False for games that are skipped, e.g. too short with remove_short
+
+    def __repr__(self):
+        if self.ok:
+            return 'RenderResult({!r}, {!r}, recorded={})'.format(self.slp_file, self.out_file, self.recorded)
+        return 'RenderResult({!r}, {!r}, error={!r})'.format(self.slp_file, self.out_file, self.error)
+
+
+class Renders:
+    """
+    The games of a render() call. Iterate over it for the RenderResults, and cancel() to stop early
+    Use it in a with block so the games are stopped and cleaned up if the caller stops iterating
+    """
+    def __init__(self, replays, out_dir, settings, max_pending):
+        self.replays = replays
+        self.out_dir = out_dir
+        self.settings = settings
+        self.max_pending = max_pending
+        self.results = queue.Queue()
+        self.stopping = threading.Event()
+        self.pipeline = None
+        self.pipeline_lock = threading.Lock()
+        self.error = None
+        self.done = False
+        self.thread = threading.Thread(target=self.feed, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        if not self.done:
+            self.cancel()
+        self.thread.join()
+        # Re-raise any exception that occurred in the with block
+        if tb is not None:
+            return False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.done:
+            raise StopIteration
+        result = self.results.get()
+        if result is None:
+            self.done = True
+            self.thread.join()
+            if self.error is not None:
+                raise self.error
+            raise StopIteration
+        return result
+
+    def cancel(self):
+        """
+        Stop running games and don't start any more. Games that already finished are still yielded, then iteration
+        stops. Can be called from any thread
+        """
+        self.stopping.set()
+        with self.pipeline_lock:
+            if self.pipeline is not None:
+                self.pipeline.cancel()
+
+    def out_file(self, item):
+        if isinstance(item, (tuple, list)):
+            slp_file, out_file = item
+            return os.path.abspath(slp_file), os.path.abspath(out_file)
+        name, _ = os.path.splitext(os.path.basename(item))
+        return os.path.abspath(item), os.path.join(self.out_dir, name + '.mp4')
+
+    def feed(self):
+        try:
+            self.run()
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.results.put(None)
+
+    def run(self):
+        s = load_script()
+        conf = s.Config(self.settings)
+        if self.out_dir is None:
+            self.out_dir = s.OUT_DIR
+        self.out_dir = os.path.abspath(self.out_dir)
+
+        # There's no journal, so the pipeline removes the dumps of games that are cancelled
+        recorded = set()
+        lock = threading.Lock()
+
+        def render(job):
+            return s.render_slp(conf, job.slp_file, job.duration, workers, template)
+
+        def mux(job, dumps):
+            s.mux_slp(conf, dumps, job.out_file)
+            with lock:
+                recorded.add(job)
+
+        def on_job_done(job, ok, error):
+            self.results.put(RenderResult(job.slp_file, job.out_file, ok, error, job in recorded))
+            pending.release()
+
+        DOLPHIN_USER_DIR = os.path.join(conf.dolphin_dir, 'User')
+        scratch_dir = s.get_scratch_dir(conf)
+        with s.UserTemplate(conf, DOLPHIN_USER_DIR, scratch_dir) as template:
+            workers = None
+            if conf.persistent_dolphin:
+                workers = s.DolphinWorkerPool(conf, DOLPHIN_USER_DIR, scratch_dir, conf.persistent_dolphin_games,
+                                              template)
+            adaptive = s.get_adaptive_parallelism(conf)
+            num_processes = s.get_num_processes(conf) if adaptive is None else adaptive.max_games
+            # A slot for each game that's been handed to the pipeline and not finished yet, so a long generator
+            # isn't read (and scanned) far ahead of the games that are running
+            pending = threading.BoundedSemaphore(self.max_pending or 2 * num_processes)
+            pipeline = s.Pipeline(
+                render=render,
+                post=mux,
+                num_renderers=num_processes,
+                num_post=conf.parallel_encodes,
+                queue_size=num_processes,
+                slots=adaptive.slots if adaptive is not None else None,
+                job_timeout=conf.job_timeout_minutes * 60 or None,
+                retries=conf.render_retries,
+                retry_backoff=conf.retry_backoff_seconds,
+                retry_errors=(s.RenderTimeout,),
+                disk_space=s.DiskSpace(scratch_dir, int(conf.scratch_min_free_gb * 1024 * 1024 * 1024)),
+                on_job_done=on_job_done)
+            with self.pipeline_lock:
+                self.pipeline = pipeline
+                if self.stopping.is_set():
+                    pipeline.cancel()
+
+            with workers or contextlib.nullcontext(), adaptive or contextlib.nullcontext():
+                pipeline.start()
+                try:
+                    self.submit_all(s, conf, pipeline, pending)
+                finally:
+                    pipeline.join()
+
+    def submit_all(self, s, conf, pipeline, pending):
+        # The games are started in the order they're given, there's no knowing which is longest ahead of time
+        for item in self.replays:
+            slp_file, out_file = self.out_file(item)
+            while not pending.acquire(timeout=1):
+                if self.stopping.is_set():
+                    return
+            if self.stopping.is_set():
+                return
+            try:
+                duration = s.slpscanner.scan(slp_file).duration
+            except Exception as e:
+                print("ERROR: Couldn't read {}: {}".format(slp_file, e))
+                self.results.put(RenderResult(slp_file, out_file, False, str(e)))
+                pending.release()
+                continue
+            os.makedirs(os.path.dirname(out_file), exist_ok=True)
+            job = s.Job(slp_file, out_file, duration)
+            job.cost = s.job_cost(conf, duration)
+            job.disk_bytes = s.job_disk_bytes(conf, duration)
+            pipeline.submit([job])
+
+
+def render(replays, out_dir=None, settings=None, max_pending=None):
+    """
+    Render replays (an iterable of paths or (path, mp4 path) pairs) to mp4s in out_dir, the out folder next to
+    slp-to-mp4.py by default. settings is a dict of config.json keys to use instead of the values in the file
+    max_pending is how many games are read ahead of the ones that are finished, twice the number of parallel
+    games by default
+    Returns a Renders, which yields a RenderResult as each game finishes
+    """
+    return Renders(replays, out_dir, settings, max_pending)
@@ -0,0 +1,148 @@
+import threading, contextlib
+
+# Cancelling jobs: a whole run (e.g. on Ctrl-C) or a single job that ran out of time.
+# Each job runs with a Token, a child of the run's Token. Dolphin and ffmpeg processes started or waited on while
+# a token is current are tracked by it, and cancelling the token terminates them, which wakes up whatever is
+# waiting for them. The waiter then raises Cancelled instead of treating the half-finished output as done.
+# Like telemetry, the current token is per thread, so nothing has to be passed down just for cancelling.
+
+local = threading.local()
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Token:
+    def __init__(self, parent=None, timeout=None):
+        self.parent = parent
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.reason = None
+        self.procs = set()
+        self.children = set()
+        self.timer = None
+        if parent is not None:
+            parent.add_child(self)
+        self.start_timer(timeout)
+
+    def child(self, timeout=None):
+        return Token(self, timeout)
+
+    def add_child(self, child):
+        with self.lock:
+            self.children.add(child)
+            cancelled = self.event.is_set()
+        if cancelled:
+            child.cancel(self.reason)
+
+    def start_timer(self, timeout):
+        """
+        Cancel the token in timeout seconds (never if it's None), instead of when an earlier timer would have
+        """
+        self.stop_timer()
+        if timeout:
+            self.timer = threading.Timer(timeout, self.cancel, ["timed out after {:.0f}s".format(timeout)])
+            self.timer.daemon = True
+            self.timer.start()
+
+    def stop_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+    def close(self):
+        """
+        Call once the job is finished, so a timeout doesn't fire later
+        """
+        self.stop_timer()
+        if self.parent is not None:
+            with self.parent.lock:
+                self.parent.children.discard(self)
+
+    def cancel(self, reason="cancelled"):
+        with self.lock:
+            if self.event.is_set():
+                return
+            self.reason = reason
+            self.event.set()
+            procs = list(self.procs)
+            children = list(self.children)
+        for proc in procs:
+            terminate(proc)
+        for child in children:
+            child.cancel(reason)
+
+    def cancelled(self):
+        return self.event.is_set()
+
+    def check(self):
+        if self.event.is_set():
+            raise Cancelled(self.reason)
+
+
+def terminate(proc):
+    if proc.poll() is None:
+        try:
+            proc.terminate()
+        except OSError:
+            pass
+
+
+def current():
+    return getattr(local, 'token', None)
+
+
+@contextlib.contextmanager
+def scope(token):
+    """
+    Make token the current token in this thread while in the with block
+    """
+    previous = current()
+    local.token = token
+    try:
+        yield
+    finally:
+        local.token = previous
+
+
+@contextlib.contextmanager
+def tracking(proc):
+    """
+    Terminate proc if the current token is cancelled while in the with block
+    """
+    token = current()
+    if token is None or proc is None:
+        yield
+        return
+    with token.lock:
+        token.procs.add(proc)
+        cancelled = token.event.is_set()
+    if cancelled:
+        terminate(proc)
+    try:
+        yield
+    finally:
+        with token.lock:
+            token.procs.discard(proc)
+
+
+def check():
+    """
+    Raise Cancelled if the current token was cancelled
+    """
+    token = current()
+    if token is not None:
+        token.check()
+
+
+def run_cancelled():
+    """
+    True if the whole run the current token belongs to was cancelled, as opposed to only its job (e.g. it timed out)
+    """
+    token = current()
+    if token is None:
+        return False
+    while token.parent is not None:
+        token = token.parent
+    return token.cancelled()
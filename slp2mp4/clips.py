@@ -0,0 +1,79 @@
+import os, json
+import slpscanner
+
+# Clips: a range of frames of a replay, rendered instead of the whole game. The playback Dolphin is told to
+# start and stop at those frames through the comm file (startFrame / endFrame), so only the clip is rendered.
+# Frame numbers are Slippi's, which start at -123 and count up to the game's last frame.
+#
+# A clip manifest is a JSON list of clips:
+# [
+#     {"replay": "Game_20190519T162734.slp", "start_frame": 4000, "end_frame": 4600},
+#     {"replay": "Game_20190519T162734.slp", "start_frame": 9000, "output": "last_stock.mp4"}
+# ]
+# start_frame and end_frame default to the start and end of the game. Replay paths are relative to the manifest,
+# outputs are relative to the output directory and default to <replay name>_<start frame>-<end frame>.mp4
+
+FIRST_FRAME_INDEX = slpscanner.FIRST_FRAME_INDEX
+
+
+class Clip:
+    def __init__(self, slp_file, start_frame=None, end_frame=None, out_file=None):
+        self.slp_file = slp_file
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.out_file = out_file
+
+    def resolve(self, duration):
+        """
+        Fill in missing frames and clamp the range to the game, given the number of frames in the game
+        """
+        last_frame = FIRST_FRAME_INDEX + duration - 1
+        start_frame = FIRST_FRAME_INDEX if self.start_frame is None else self.start_frame
+        end_frame = last_frame if self.end_frame is None else self.end_frame
+        self.start_frame = max(start_frame, FIRST_FRAME_INDEX)
+        self.end_frame = min(end_frame, last_frame)
+        if self.end_frame < self.start_frame:
+            raise RuntimeError("{}: clip {} to {} is outside the game (frames {} to {})".format(
+                self.slp_file, start_frame, end_frame, FIRST_FRAME_INDEX, last_frame))
+
+    def num_frames(self):
+        return self.end_frame - self.start_frame + 1
+
+    def default_out_file(self, out_dir):
+        name, _ = os.path.splitext(os.path.basename(self.slp_file))
+        return os.path.join(out_dir, '{}_{}-{}.mp4'.format(name, self.start_frame, self.end_frame))
+
+
+def load_manifest(manifest_file, out_dir):
+    """
+    Returns the clips in a clip manifest, with their replay paths made absolute. Clips without an output are
+    given one once their frames are resolved
+    """
+    with open(manifest_file) as f:
+        entries = json.load(f)
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_file))
+
+    clips = []
+    for entry in entries:
+        if 'replay' not in entry:
+            raise RuntimeError("{}: every clip needs a replay".format(manifest_file))
+        out_file = entry.get('output')
+        if out_file is not None:
+            out_file = os.path.join(out_dir, out_file)
+        clips.append(Clip(os.path.join(manifest_dir, entry['replay']),
+                          entry.get('start_frame'), entry.get('end_frame'), out_file))
+    return clips
+
+
+def by_replay(clips):
+    """
+    Group clips by replay, so each replay's clips can be rendered one after another by the same Dolphin
+    Returns {slp_file: [Clip]} with each replay's clips in frame order
+    """
+    groups = {}
+    for clip in clips:
+        groups.setdefault(clip.slp_file, []).append(clip)
+    for group in groups.values():
+        # Frames aren't resolved yet, a clip without a start frame starts at the start of the game
+        group.sort(key=lambda clip: FIRST_FRAME_INDEX if clip.start_frame is None else clip.start_frame)
+    return groups
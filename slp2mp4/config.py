@@ -1,5 +1,6 @@
 import os, json, sys
 import shutil
+import variants
 
 THIS_DIR, _ = os.path.split(os.path.abspath(__file__))
 
@@ -11,9 +12,13 @@ else:
     DOLPHIN_NAME = 'dolphin-emu'
 
 class Config:
-    def __init__(self):
+    def __init__(self, settings=None):
+        """
+        settings is a dict of config.json keys to use instead of the values in the file
+        """
         with open(THIS_CONFIG, 'r') as f:
             j = json.loads(f.read())
+            j.update(settings or {})
             self.melee_iso = os.path.expanduser(j['melee_iso'])
             self.check_path(self.melee_iso)
             self.dolphin_dir = os.path.expanduser(j['dolphin_dir'])
@@ -24,8 +29,28 @@ class Config:
             self.widescreen = j['widescreen']
             self.bitrateKbps = j['bitrateKbps']
             self.parallel_games = j['parallel_games']
+            self.adaptive_fps_floor = j.get('adaptive_fps_floor', 58)
+            self.adaptive_max_games = j.get('adaptive_max_games', "recommended")
+            self.parallel_encodes = j.get('parallel_encodes', 2)
+            self.persistent_dolphin = j.get('persistent_dolphin', False)
+            self.persistent_dolphin_games = j.get('persistent_dolphin_games', 20)
             self.remove_short = j['remove_short']
+            self.max_attempts = j.get('max_attempts', 3)
+            self.scratch_dir = j.get('scratch_dir', "")
+            self.scratch_min_free_gb = j.get('scratch_min_free_gb', 2)
+            self.job_timeout_minutes = j.get('job_timeout_minutes', 20)
+            self.stall_seconds = j.get('stall_seconds', 60)
+            self.render_retries = j.get('render_retries', 2)
+            self.retry_backoff_seconds = j.get('retry_backoff_seconds', 10)
+            self.output_cache_dir = j.get('output_cache_dir', "")
+            self.output_cache_max_gb = j.get('output_cache_max_gb', 50)
+            self.status_file = j.get('status_file', "status.json")
+            self.status_port = j.get('status_port', 0)
+            self.status_print_seconds = j.get('status_print_seconds', 5)
+            self.watch_stable_seconds = j.get('watch_stable_seconds', 120)
+            self.variants = variants.parse(j.get('variants', []), self.resolution)
             self.combine = j['combine']
+            self.single_pass_combine = j.get('single_pass_combine', False)
 
         self.dolphin_bin = os.path.join(self.dolphin_dir, DOLPHIN_NAME)
         self.check_path(self.dolphin_bin)
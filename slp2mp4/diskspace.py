@@ -0,0 +1,92 @@
+import shutil, threading, contextlib
+
+# Admission control for disk space. Dolphin dumps a game's video at the configured bitrate plus uncompressed audio
+# into the scratch directory, and nothing stops it when the disk fills up. So a game is only started if the disk
+# will still have room for its dumps, counting the dumps of the games that are rendering now at their full
+# estimated size. Dumps that are finished already show up in the free space.
+# A game that has to wait is started once other games' dumps are muxed and removed. If nothing else is running
+# there is nothing to wait for, and the game fails.
+
+AUDIO_BYTES_PER_SECOND = 32000 * 2 * 2     # Dolphin dumps audio as 32 kHz 16-bit stereo
+ESTIMATE_SLACK = 1.25                       # Dolphin's encoder doesn't stick to the bitrate exactly
+CHECK_INTERVAL = 5                          # seconds between checks while waiting, other programs use the disk too
+
+
+def estimate_dump_bytes(seconds, bitrate_kbps):
+    return int(seconds * (bitrate_kbps * 1000 / 8 + AUDIO_BYTES_PER_SECOND) * ESTIMATE_SLACK)
+
+
+def gb(num_bytes):
+    return num_bytes / 1024 ** 3
+
+
+class NotEnoughSpace(RuntimeError):
+    pass
+
+
+class DiskSpace:
+    def __init__(self, path, min_free_bytes):
+        """
+        path is the directory the dumps are written to. min_free_bytes are left free for everything else
+        """
+        self.path = path
+        self.min_free_bytes = min_free_bytes
+        self.cond = threading.Condition()
+        # job -> estimated bytes still to be written, for every job admitted and not yet finished
+        self.admitted = {}
+
+    def free_bytes(self):
+        return shutil.disk_usage(self.path).free
+
+    def admit(self, job, token=None):
+        """
+        Block until there is room for the job's dumps (job.disk_bytes)
+        token, if given, is the job's cancellation.Token, waiting stops if it's cancelled
+        """
+        waiting = False
+        with self.cond:
+            while True:
+                free = self.free_bytes()
+                available = free - sum(self.admitted.values()) - self.min_free_bytes
+                if available >= job.disk_bytes:
+                    self.admitted[job] = job.disk_bytes
+                    return
+                if not self.admitted:
+                    raise NotEnoughSpace("Not enough space in {}: {:.1f} GB is free, the dumps need {:.1f} GB and "
+                                         "{:.1f} GB must be left free".format(self.path, gb(free), gb(job.disk_bytes),
+                                                                              gb(self.min_free_bytes)))
+                if not waiting:
+                    print("Waiting for disk space in {} to record {}".format(self.path, job.slp_file))
+                    waiting = True
+                self.cond.wait(CHECK_INTERVAL)
+                if token is not None:
+                    token.check()
+
+    def rendered(self, job):
+        """
+        The job's dumps are written, so they're counted in the free space from now on
+        """
+        with self.cond:
+            if job in self.admitted:
+                self.admitted[job] = 0
+
+    def release(self, job):
+        """
+        The job is finished and its dumps are removed (or it failed). Safe to call more than once
+        """
+        with self.cond:
+            self.admitted.pop(job, None)
+            self.cond.notify_all()
+
+    @contextlib.contextmanager
+    def reserve(self, job, token=None):
+        """
+        Admit the job for the with block, which renders it. If rendering fails the job is released
+        """
+        self.admit(job, token)
+        try:
+            yield
+        except BaseException:
+            self.release(job)
+            raise
+        self.rendered(job)
@@ -0,0 +1,240 @@
+import os, json, time, uuid, socket, threading
+
+# A job queue in a shared directory (e.g. an NFS or SMB share every render box mounts), for spreading a folder
+# run over several machines. Each job is a JSON file, and moving it between these subdirectories is atomic:
+#   queued/<id>.json            waiting for a worker
+#   leased/<id>@<worker>.json   being recorded by a worker, which touches the file as a heartbeat
+#   done/<id>.json, failed/<id>.json    finished, with the result, waiting for the coordinator to collect it
+# Whoever renames a file first wins: two workers can't claim the same job, and a worker can't finish a job the
+# coordinator has already taken back.
+#
+# The coordinator measures heartbeats on its own clock (it watches for the lease file's mtime to change), so the
+# clocks of the render boxes don't matter. A lease that hasn't changed for lease_seconds is put back in the queue.
+
+SUBDIRS = ('queued', 'leased', 'done', 'failed')
+CLOSED_FILE = 'closed'
+
+
+def read_job(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_job(path, job):
+    # Write then rename, so nobody sees a half-written job
+    tmp_path = os.path.join(os.path.dirname(path), '.{}.tmp'.format(uuid.uuid4()))
+    with open(tmp_path, 'w') as f:
+        json.dump(job, f)
+    os.replace(tmp_path, path)
+
+
+def make_worker_id():
+    return '{}-{}-{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+
+class Lease:
+    """
+    A worker's claim on a job
+    """
+    def __init__(self, queue, job, path):
+        self.queue = queue
+        self.job = job
+        self.path = path
+        self.lost = False
+
+    def heartbeat(self):
+        """
+        Returns False if the coordinator has taken the job back
+        """
+        try:
+            os.utime(self.path)
+        except FileNotFoundError:
+            self.lost = True
+        return not self.lost
+
+    def finish(self, ok, result):
+        """
+        Hand the job back with its result. Returns False if the coordinator had already taken it back
+        """
+        job = dict(self.job, ok=ok, **result)
+        subdir = 'done' if ok else 'failed'
+        # Move it out of leased before writing the result, so it can't be taken back halfway
+        finishing = os.path.join(self.queue.queue_dir, subdir, '.{}.finishing'.format(job['id']))
+        try:
+            os.rename(self.path, finishing)
+        except FileNotFoundError:
+            self.lost = True
+            return False
+        write_job(finishing, job)
+        os.rename(finishing, self.queue.path(subdir, job['id']))
+        return True
+
+
+class Heartbeat:
+    """
+    Keeps a lease alive from a background thread while the job is recorded
+    """
+    def __init__(self, lease, interval):
+        self.lease = lease
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.beat, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.stopping.set()
+        self.thread.join()
+        # Re-raise any exception that occurred in the with block
+        if tb is not None:
+            return False
+
+    def beat(self):
+        while not self.stopping.wait(self.interval):
+            if not self.lease.heartbeat():
+                print("Warning: Lost the lease on {}, another worker will record it".format(self.lease.job['slp_file']))
+                return
+
+
+class DirQueue:
+    def __init__(self, queue_dir):
+        self.queue_dir = queue_dir
+        # Coordinator only: lease file -> (mtime last seen, when it was last seen to change)
+        self.heartbeats = {}
+
+    def __enter__(self):
+        for subdir in SUBDIRS:
+            os.makedirs(os.path.join(self.queue_dir, subdir), exist_ok=True)
+        return self
+
+    def __exit__(self, type, value, tb):
+        # Re-raise any exception that occurred in the with block
+        if tb is not None:
+            return False
+
+    def path(self, subdir, job_id, worker_id=None):
+        name = job_id if worker_id is None else '{}@{}'.format(job_id, worker_id)
+        return os.path.join(self.queue_dir, subdir, name + '.json')
+
+    def list(self, subdir):
+        return sorted(f for f in os.listdir(os.path.join(self.queue_dir, subdir))
+                      if f.endswith('.json') and not f.startswith('.'))
+
+    # Coordinator
+
+    def reset(self):
+        """
+        Remove everything left by an earlier run
+        """
+        for subdir in SUBDIRS:
+            for file in os.listdir(os.path.join(self.queue_dir, subdir)):
+                os.remove(os.path.join(self.queue_dir, subdir, file))
+        if os.path.exists(os.path.join(self.queue_dir, CLOSED_FILE)):
+            os.remove(os.path.join(self.queue_dir, CLOSED_FILE))
+        self.heartbeats = {}
+
+    def publish(self, job):
+        """
+        job is a dict with at least 'id', 'slp_file' and 'out_file'
+        """
+        write_job(self.path('queued', job['id']), dict(job, attempts=job.get('attempts', 0)))
+
+    def close(self):
+        """
+        Tell the workers there will be no more jobs
+        """
+        open(os.path.join(self.queue_dir, CLOSED_FILE), 'w').close()
+
+    def check_leases(self, lease_seconds, max_attempts):
+        """
+        Put jobs whose worker stopped heartbeating back in the queue, or fail them after max_attempts
+        Returns [(job_id, worker_id)] newly leased since the last check, and [job] that were taken back
+        """
+        now = time.monotonic()
+        new_leases = []
+        expired = []
+        current = set()
+        for file in self.list('leased'):
+            path = os.path.join(self.queue_dir, 'leased', file)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            current.add(file)
+            if file not in self.heartbeats:
+                job_id, worker_id = file[:-len('.json')].split('@', 1)
+                new_leases.append((job_id, worker_id))
+                self.heartbeats[file] = (mtime, now)
+            elif self.heartbeats[file][0] != mtime:
+                self.heartbeats[file] = (mtime, now)
+            elif now - self.heartbeats[file][1] > lease_seconds:
+                job = self.take_back(path, max_attempts)
+                if job is not None:
+                    expired.append(job)
+
+        for file in set(self.heartbeats) - current:
+            del self.heartbeats[file]
+        return new_leases, expired
+
+    def take_back(self, lease_path, max_attempts):
+        # Move it out of leased first, so a worker that comes back to life can't finish it too
+        job_id = os.path.basename(lease_path).split('@', 1)[0]
+        expired = os.path.join(self.queue_dir, 'leased', '.{}.expired'.format(job_id))
+        try:
+            os.rename(lease_path, expired)
+        except FileNotFoundError:
+            # The worker finished it after all
+            return None
+
+        job = read_job(expired)
+        job['attempts'] = job.get('attempts', 0) + 1
+        if job['attempts'] >= max_attempts:
+            job['ok'] = False
+            job['error'] = "worker stopped responding {} times".format(job['attempts'])
+            target = self.path('failed', job['id'])
+        else:
+            target = self.path('queued', job['id'])
+        write_job(expired, job)
+        os.rename(expired, target)
+        return job
+
+    def collect(self):
+        """
+        Returns the finished jobs (with 'ok' and the worker's result) and removes them from the queue
+        """
+        results = []
+        for subdir in ('done', 'failed'):
+            for file in self.list(subdir):
+                path = os.path.join(self.queue_dir, subdir, file)
+                job = read_job(path)
+                os.remove(path)
+                results.append(job)
+        return results
+
+    # Worker
+
+    def is_closed(self):
+        return os.path.exists(os.path.join(self.queue_dir, CLOSED_FILE))
+
+    def claim(self, worker_id):
+        """
+        Take the next queued job. Returns a Lease, or None if the queue is empty
+        """
+        for file in self.list('queued'):
+            job_id = file[:-len('.json')]
+            lease_path = self.path('leased', job_id, worker_id)
+            try:
+                os.rename(os.path.join(self.queue_dir, 'queued', file), lease_path)
+            except FileNotFoundError:
+                # Another worker got it first
+                continue
+            # The rename doesn't change the mtime, so touch it to start the lease
+            os.utime(lease_path)
+            try:
+                return Lease(self, read_job(lease_path), lease_path)
+            except FileNotFoundError:
+                continue
+        return None
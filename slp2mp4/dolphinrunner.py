@@ -1,35 +1,133 @@
-import os, sys, subprocess, time, shutil, uuid, json, configparser
-
-MAX_WAIT_SECONDS = 8 * 60 + 30
+import os, sys, subprocess, time, shutil, uuid, json, threading, configparser
+from renderprogress import RenderProgress
+import telemetry, cancellation, status
+
+FPS = 60
+# A game gets DEADLINE_SLACK times as long as it should take at the rate games have been rendering, plus
+# STARTUP_SECONDS for Dolphin to load. Until it has seen its first frame, Dolphin isn't considered stalled either
+STARTUP_SECONDS = 60
+DEADLINE_SLACK = 2
+# How often to check the deadline while Dolphin is quiet, it moves as the render rate is measured
+DEADLINE_CHECK_SECONDS = 5
+PROGRESS_PRINT_SECONDS = 1
 RESOLUTION_DICT = {'480p': '2', '720p': '3', '1080p': '5', '1440p': '6', '2160p': '8'}
+# Roughly how much slower than real time Dolphin renders at each resolution, for estimating how long games take
+RESOLUTION_COST = {'480p': 1.0, '720p': 1.0, '1080p': 1.3, '1440p': 1.7, '2160p': 2.5}
+
+
+def expected_render_seconds(num_frames, resolution):
+    return num_frames / FPS * RESOLUTION_COST.get(resolution, 1.0)
+
+
+class RenderTimeout(RuntimeError):
+    """
+    Dolphin missed its deadline or stopped rendering, and was stopped
+    """
+    pass
+
+
+class RenderRate:
+    """
+    Running average of the frame rate games have been rendering at, shared by every Dolphin in the run
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fps = None
+
+    def add(self, fps):
+        if not fps:
+            return
+        with self.lock:
+            self.fps = fps if self.fps is None else 0.8 * self.fps + 0.2 * fps
+
+    def deadline_seconds(self, num_frames):
+        """
+        How long rendering num_frames may take, from telling Dolphin to play the replay
+        """
+        # Assume real time until a game has finished
+        fps = self.fps or FPS
+        return STARTUP_SECONDS + num_frames / fps * DEADLINE_SLACK
+
+
+render_rate = RenderRate()
+
 
 class CommFile:
-    def __init__(self, comm_path, slp_file, job_id):
+    def __init__(self, comm_path, slp_file, job_id, start_frame=None, end_frame=None):
+        self.comm_path = comm_path
+        self.set_replay(slp_file, job_id, start_frame, end_frame)
+
+    def set_replay(self, slp_file, job_id, start_frame=None, end_frame=None):
+        """
+        start_frame and end_frame (Slippi frame numbers) play only part of the replay
+        """
         self.comm_data = {
             'mode': 'normal',                       # idk
             'replay': slp_file,
             'isRealTimeMode': False,                # idk
             'commandId': str(job_id)           # can be any random string, stops dolphin getting confused playing same file twice in a row
         }
-        self.comm_path = comm_path
+        if start_frame is not None:
+            self.comm_data['startFrame'] = start_frame
+        if end_frame is not None:
+            self.comm_data['endFrame'] = end_frame
 
-    def __enter__(self):
+    def write(self):
+        # A running Dolphin plays the new replay when it sees a new commandId
         with open(self.comm_path, 'w') as f:
             f.write(json.dumps(self.comm_data))
 
+    def __enter__(self):
+        self.write()
+        return self
+
     def __exit__(self, type, value, tb):
         os.remove(self.comm_path)
         # Re-raise any exception that occurred in the with block
         if tb is not None:
             return False
 
+
+class Dumps:
+    """
+    The video and audio Dolphin dumped for one game
+    If the dump files hold more than one game, start (seconds into each file) and duration say which part is this game's
+    """
+    def __init__(self, video_file, audio_file, user_dir, video_start=None, audio_start=None, duration=None, owner=None):
+        self.video_file = video_file
+        self.audio_file = audio_file
+        self.user_dir = user_dir
+        self.video_start = video_start
+        self.audio_start = audio_start
+        self.duration = duration
+        # The dolphinworker.DumpSet the files belong to, if they're shared with other games
+        self.owner = owner
+
+    def is_shared(self):
+        return self.owner is not None
+
+    def release(self):
+        """
+        Call once the dumps have been muxed
+        """
+        if self.owner is not None:
+            self.owner.release()
+        else:
+            shutil.rmtree(self.user_dir, ignore_errors=True)
+
+
 class DolphinRunner:
 
-    def __init__(self, conf, base_user_dir, working_dir, job_id):
+    def __init__(self, conf, base_user_dir, working_dir, job_id, template=None):
         self.conf = conf
         self.job_id = job_id
         self.base_user_dir = base_user_dir
+        # usertemplate.UserTemplate to clone the user dir from. It already has our settings applied
+        self.template = template
         self.user_dir = os.path.join(working_dir, 'User-{}'.format(job_id))
+        # Set to keep the user dir (and the dumps in it) around after the with block, e.g. so they can be muxed
+        # later. Whoever sets this is responsible for removing it
+        self.keep_user_dir = False
 
         # Get all needed paths
         self.comm_file = os.path.join(working_dir, 'slippi-comm-{}.txt'.format(self.job_id))
@@ -43,26 +141,25 @@ class DolphinRunner:
 
     def __enter__(self):
         # Create a new user dir for this job
-        shutil.copytree(self.base_user_dir, self.user_dir)
+        with telemetry.phase('copy_user_dir'):
+            if self.template is not None:
+                self.template.clone(self.user_dir)
+            else:
+                shutil.copytree(self.base_user_dir, self.user_dir)
         return self
 
     def __exit__(self, type, value, tb):
-        shutil.rmtree(self.user_dir, ignore_errors=True)
+        if not self.keep_user_dir or tb is not None:
+            shutil.rmtree(self.user_dir, ignore_errors=True)
         # Re-raise any exception that occurred in the with block
         if tb is not None:
             return False
 
-    def count_frames_completed(self):
-        num_completed = 0
-
-        if os.path.exists(self.render_time_file):
-            with open(self.render_time_file, 'r') as f:
-                num_completed = len(list(f))
-
-        print("Rendered ",num_completed," frames")
-        return num_completed
-
     def prep_dolphin_settings(self):
+        with telemetry.phase('prep_ini'):
+            self.write_dolphin_settings()
+
+    def write_dolphin_settings(self):
 
         # TODO should we do this?
         # Can't specify separate Sys directory like we can with User, so this would overwrite user's Sys settings
@@ -197,6 +294,8 @@ class DolphinRunner:
         # TODO: patch Dolphin I guess
         os.makedirs(self.frames_dir, exist_ok=True)
         os.makedirs(self.audio_dir, exist_ok=True)
+        # Needs to exist so we can watch it for the render time file
+        os.makedirs(os.path.dirname(self.render_time_file), exist_ok=True)
 
     def get_dump_files(self):
         """
@@ -215,50 +314,122 @@ class DolphinRunner:
 
         return video_file, audio_file
 
-    def run(self, slp_file, num_frames):
+    def wait_for_frames(self, progress, num_frames, on_wake=None, slp_file=None):
+        """
+        Returns when num_frames have been rendered or Dolphin exits
+        on_wake, if given, is called every time new frames are seen
+        slp_file is the replay being rendered, for status reports
+        Raises RenderTimeout if Dolphin misses its deadline or stalls, and cancellation.Cancelled if the job is
+        cancelled. Either way the caller must stop Dolphin
+        """
+        start = time.perf_counter()
+        progress.set_active(True, slp_file, num_frames)
+        try:
+            with cancellation.tracking(progress.proc):
+                self.wait_for_frames_active(progress, num_frames, on_wake)
+            render_rate.add(progress.mean_fps())
+        finally:
+            # From Dolphin being launched (or told to play the replay, if it's already running) to the first frame
+            if progress.first_sample is not None:
+                telemetry.record('first_frame_seconds', progress.first_sample[0] - start)
+            telemetry.record('fps_mean', progress.mean_fps())
+            telemetry.record('fps_min', progress.min_fps)
+            progress.set_active(False)
+
+    def wait_for_frames_active(self, progress, num_frames, on_wake):
+        start_timer = time.perf_counter()
+        last_print = start_timer
+        frames_to_render = num_frames - progress.update()
+        stall_seconds = self.conf.stall_seconds
+        while progress.update() < num_frames:
+            # Cancelling terminates Dolphin, which wakes us up
+            cancellation.check()
+            now = time.perf_counter()
+            if on_wake is not None:
+                on_wake()
+
+            # The rate changes as games finish, starting with the first ones
+            timeout = render_rate.deadline_seconds(frames_to_render)
+            deadline = start_timer + timeout
+            if now > deadline:
+                raise RenderTimeout("Timed out after {:.0f}s with {} of {} frames rendered".format(
+                    timeout, progress.frames, num_frames))
+
+            # Before the first frame Dolphin may still be loading
+            if progress.last_sample is not None:
+                last_frame_time, stall_limit = progress.last_sample[0], stall_seconds
+            else:
+                last_frame_time, stall_limit = start_timer, stall_seconds + STARTUP_SECONDS
+            if stall_seconds and now - last_frame_time > stall_limit:
+                raise RenderTimeout("Dolphin stalled, no new frames for {:.0f}s with {} of {} frames rendered".format(
+                    now - last_frame_time, progress.frames, num_frames))
+
+            if progress.dolphin_exited():
+                # Dolphin may have written the last frames just before exiting
+                if progress.update() < num_frames:
+                    print("WARNING: Dolphin exited before replay finished - may not have recorded entire replay")
+                return
+
+            # The run's status summary covers this game
+            if now - last_print >= PROGRESS_PRINT_SECONDS and not status.summarizing():
+                print("Rendered ", progress.frames, " frames")
+                last_print = now
+
+            wake = min(deadline, now + DEADLINE_CHECK_SECONDS)
+            if stall_seconds:
+                wake = min(wake, last_frame_time + stall_limit)
+            # Just past it, so the check above sees it's passed
+            progress.wait(wake - now + 0.01)
+        if not status.summarizing():
+            print("Rendered ", progress.frames, " frames")
+
+    def launch(self, batch=True):
+        """
+        Start Dolphin playing whatever the comm file says
+        With batch=False Dolphin keeps running after the replay ends and waits for the next command in the comm file
+        """
+        # Construct command string and run dolphin
+        cmd = [
+            self.conf.dolphin_bin,
+            '-i', self.comm_file,       # The comm file tells dolphin which slippi file to play (see above)
+            '-e', self.conf.melee_iso,  # ISO to use
+            '-u', self.user_dir         # specify User dir
+            ]
+        if batch:
+            cmd.append('-b')            # Exit dolphin when emulation ends
+        print(' '.join(cmd))
+        # TODO run faster than realtime if possible
+        return subprocess.Popen(args=cmd)
+
+    def stop(self, proc_dolphin):
+        # Kill dolphin
+        proc_dolphin.terminate()
+        try:
+            proc_dolphin.wait(timeout=5)
+        except subprocess.TimeoutExpired as t:
+            print ("Warning: timed out waiting for Dolphin to terminate")
+            proc_dolphin.kill()
+
+    def run(self, slp_file, num_frames, start_frame=None, end_frame=None):
         """
         Run Dolphin, dumping frames and audio and returning when done
+        start_frame and end_frame, if given, play only that part of the replay. num_frames is the number of frames
+        that will be rendered
         Returns path_of_video_file, path_of_audio_file
         """
 
-        self.prep_dolphin_settings()
+        if self.template is None:
+            self.prep_dolphin_settings()
         self.prep_user_dir()
 
         # Create a slippi 'comm' file to tell dolphin which file to play
-        with CommFile(self.comm_file, slp_file, self.job_id):
-
-            # Construct command string and run dolphin
-            cmd = [
-                self.conf.dolphin_bin,
-                '-i', self.comm_file,       # The comm file tells dolphin which slippi file to play (see above)
-                '-b',                       # Exit dolphin when emulation ends
-                '-e', self.conf.melee_iso,  # ISO to use
-                '-u', self.user_dir         # specify User dir
-                ]
-            print(' '.join(cmd))
-            # TODO run faster than realtime if possible
-            proc_dolphin = subprocess.Popen(args=cmd)
-
-            # Poll file until done
-            start_timer = time.perf_counter()
-            while self.count_frames_completed() < num_frames:
-
-                if time.perf_counter() - start_timer > MAX_WAIT_SECONDS:
-                    print("WARNING: Timed out waiting for render")
-                    break
-
-                if proc_dolphin.poll() is not None:
-                    print("WARNING: Dolphin exited before replay finished - may not have recorded entire replay")
-                    break
-
-                time.sleep(1)
-
-            # Kill dolphin
-            proc_dolphin.terminate()
+        with CommFile(self.comm_file, slp_file, self.job_id, start_frame, end_frame):
+            proc_dolphin = self.launch()
             try:
-                proc_dolphin.wait(timeout=5)
-            except subprocess.TimeoutExpired as t:
-                print ("Warning: timed out waiting for Dolphin to terminate")
-                proc_dolphin.kill()
+                # Watch the render time file until done
+                with RenderProgress(self.render_time_file, proc_dolphin) as progress:
+                    self.wait_for_frames(progress, num_frames, slp_file=slp_file)
+            finally:
+                self.stop(proc_dolphin)
 
-        return self.get_dump_files()
\ No newline at end of file
+        return self.get_dump_files()
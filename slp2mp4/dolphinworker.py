@@ -0,0 +1,191 @@
+import os, threading, shutil, struct, uuid
+from dolphinrunner import DolphinRunner, CommFile, Dumps, FPS
+from renderprogress import RenderProgress
+
+# Long-lived Dolphins that play one replay after another, instead of starting a new Dolphin for every game.
+# Each new replay is sent to the running Dolphin by writing a new commandId to its comm file, which saves the
+# process startup, ISO load and shader compilation for every game after the first.
+#
+# Dolphin keeps dumping into the same files across replays, so each game's part of the dumps is found from
+# the number of frames rendered (video) and the size of the audio dump when the game was started.
+# This relies on the frame dump having a keyframe on every frame, which is what Dolphin writes, so the
+# video can be cut without re-encoding.
+
+WAV_BYTE_RATE_OFFSET = 28
+WAV_HEADER_SIZE = 44
+
+
+class DumpSet:
+    """
+    The dumps written by one Dolphin launch
+    The user dir is removed once Dolphin has stopped and every game in it has been muxed
+    """
+    def __init__(self, user_dir):
+        self.user_dir = user_dir
+        self.lock = threading.Lock()
+        self.refs = 0
+        self.closed = False
+
+    def acquire(self):
+        with self.lock:
+            self.refs += 1
+
+    def release(self):
+        with self.lock:
+            self.refs -= 1
+            remove = self.closed and self.refs == 0
+        if remove:
+            shutil.rmtree(self.user_dir, ignore_errors=True)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            remove = self.refs == 0
+        if remove:
+            shutil.rmtree(self.user_dir, ignore_errors=True)
+
+
+def audio_dump_seconds(audio_file):
+    """
+    Returns how many seconds of audio Dolphin has written to audio_file so far
+    """
+    try:
+        with open(audio_file, 'rb') as f:
+            header = f.read(WAV_HEADER_SIZE)
+            size = os.fstat(f.fileno()).st_size
+    except FileNotFoundError:
+        return 0
+    if len(header) < WAV_HEADER_SIZE:
+        return 0
+    byte_rate = struct.unpack_from('<I', header, WAV_BYTE_RATE_OFFSET)[0]
+    return (size - WAV_HEADER_SIZE) / byte_rate if byte_rate else 0
+
+
+class DolphinWorker:
+    def __init__(self, conf, base_user_dir, working_dir, max_games, template=None):
+        self.conf = conf
+        self.base_user_dir = base_user_dir
+        self.working_dir = working_dir
+        self.max_games = max_games      # restart Dolphin after this many games, so the dumps don't grow forever
+        self.template = template
+
+        self.runner = None
+        self.proc = None
+        self.progress = None
+        self.comm = None
+        self.dump_set = None
+        self.num_games = 0
+        # Number of frames rendered when Dolphin switched to the second frame dump file
+        self.video_file1_start = None
+
+    def start(self, slp_file, job_id, start_frame=None, end_frame=None):
+        self.runner = DolphinRunner(self.conf, self.base_user_dir, self.working_dir, uuid.uuid4(), self.template)
+        self.runner.keep_user_dir = True
+        self.runner.__enter__()
+        if self.template is None:
+            self.runner.prep_dolphin_settings()
+        self.runner.prep_user_dir()
+        self.dump_set = DumpSet(self.runner.user_dir)
+
+        self.comm = CommFile(self.runner.comm_file, slp_file, job_id, start_frame, end_frame)
+        self.comm.write()
+        self.proc = self.runner.launch(batch=False)
+        self.progress = RenderProgress(self.runner.render_time_file, self.proc)
+        self.progress.__enter__()
+        self.num_games = 0
+        self.video_file1_start = None
+
+    def stop(self):
+        if self.proc is None:
+            return
+        self.progress.__exit__(None, None, None)
+        self.runner.stop(self.proc)
+        os.remove(self.comm.comm_path)
+        self.dump_set.close()
+        self.proc = None
+
+    def check_video_file(self):
+        if self.video_file1_start is None and os.path.exists(self.runner.video_file1):
+            self.video_file1_start = self.progress.frames
+
+    def render(self, slp_file, num_frames, start_frame=None, end_frame=None):
+        """
+        Play slp_file (or the frames from start_frame to end_frame of it), returning once num_frames have been rendered
+        Returns Dumps, which must be released once muxed
+        """
+        job_id = uuid.uuid4()
+        if self.proc is not None and (self.num_games >= self.max_games or self.proc.poll() is not None):
+            self.stop()
+
+        if self.proc is None:
+            self.start(slp_file, job_id, start_frame, end_frame)
+        else:
+            self.comm.set_replay(slp_file, job_id, start_frame, end_frame)
+            self.comm.write()
+
+        start_frame = self.progress.update()
+        audio_start = audio_dump_seconds(self.runner.audio_file)
+        self.runner.wait_for_frames(self.progress, start_frame + num_frames, on_wake=self.check_video_file,
+                                    slp_file=slp_file)
+        self.check_video_file()
+        self.num_games += 1
+        rendered_frames = self.progress.frames - start_frame
+
+        video_file, audio_file = self.runner.get_dump_files()
+        video_start = start_frame
+        if video_file == self.runner.video_file1:
+            video_start = max(start_frame - self.video_file1_start, 0)
+
+        self.dump_set.acquire()
+        dumps = Dumps(video_file, audio_file, self.runner.user_dir,
+                      video_start=video_start / FPS,
+                      audio_start=audio_start,
+                      duration=rendered_frames / FPS,
+                      owner=self.dump_set)
+
+        # Dolphin exited or hung, the next game gets a new one
+        if rendered_frames < num_frames:
+            self.stop()
+        return dumps
+
+
+class DolphinWorkerPool:
+    """
+    Hands out persistent Dolphin workers to render threads, starting new ones as needed
+    """
+    def __init__(self, conf, base_user_dir, working_dir, max_games, template=None):
+        self.conf = conf
+        self.base_user_dir = base_user_dir
+        self.working_dir = working_dir
+        self.max_games = max_games
+        self.template = template
+        self.lock = threading.Lock()
+        self.idle = []
+        self.workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        for worker in self.workers:
+            worker.stop()
+        # Re-raise any exception that occurred in the with block
+        if tb is not None:
+            return False
+
+    def render(self, slp_file, num_frames, start_frame=None, end_frame=None):
+        with self.lock:
+            if self.idle:
+                worker = self.idle.pop()
+            else:
+                worker = DolphinWorker(self.conf, self.base_user_dir, self.working_dir, self.max_games, self.template)
+                self.workers.append(worker)
+        try:
+            return worker.render(slp_file, num_frames, start_frame, end_frame)
+        except Exception:
+            # Don't reuse a Dolphin in an unknown state
+            worker.stop()
+            raise
+        finally:
+            with self.lock:
+                self.idle.append(worker)
@@ -0,0 +1,99 @@
+import os, collections
+
+# Combine a subfolder's games straight from Dolphin's dumps into one video, with a single ffmpeg run, instead of
+# muxing every game to its own mp4 and then concatenating those. The video is copied, so every game's video has
+# to have the same codec parameters; the dumps are probed first and any game that doesn't match the rest (e.g.
+# Dolphin fell back to a different resolution) is re-encoded to match on its own before the combine.
+
+VIDEO_PARAMS = ('codec_name', 'width', 'height', 'pix_fmt', 'r_frame_rate')
+AUDIO_PARAMS = ('codec_name', 'sample_rate', 'channels')
+
+
+def stream_params(info, codec_type, keys):
+    """
+    Returns the parameters of the first codec_type stream in info (from FfmpegRunner.probe) as a dict
+    """
+    for stream in info['streams']:
+        if stream.get('codec_type') == codec_type:
+            return {key: stream.get(key) for key in keys}
+    return None
+
+
+def most_common(params):
+    counts = collections.Counter(tuple(sorted(p.items())) for p in params if p is not None)
+    if not counts:
+        return None
+    return dict(counts.most_common(1)[0][0])
+
+
+class Segment:
+    """
+    One game's part of the dumps
+    """
+    def __init__(self, dumps):
+        self.video_file = dumps.video_file
+        self.video_start = dumps.video_start
+        self.audio_file = dumps.audio_file
+        self.audio_start = dumps.audio_start
+        self.duration = dumps.duration
+        self.video_params = None
+        self.audio_params = None
+
+
+def probe_segments(ffmpeg_runner, segments):
+    # Games from a persistent Dolphin share dump files, only probe each file once
+    probed = {}
+
+    def probe(path):
+        if path not in probed:
+            probed[path] = ffmpeg_runner.probe(path)
+        return probed[path]
+
+    for segment in segments:
+        video_info = probe(segment.video_file)
+        segment.video_params = stream_params(video_info, 'video', VIDEO_PARAMS)
+        segment.audio_params = stream_params(probe(segment.audio_file), 'audio', AUDIO_PARAMS)
+        # Without a duration the whole dump is the game. Video and audio must be cut to the same length, otherwise
+        # they drift apart over the following games
+        if segment.duration is None:
+            segment.duration = video_info['duration']
+
+
+def convert_mismatched(ffmpeg_runner, segments, work_dir):
+    """
+    Re-encode the segments whose streams don't match the most common parameters
+    """
+    video_params = most_common(s.video_params for s in segments)
+    audio_params = most_common(s.audio_params for s in segments)
+    for i, segment in enumerate(segments):
+        if segment.video_params != video_params:
+            print("Warning: video of {} doesn't match the other games, re-encoding it".format(segment.video_file))
+            video_file = os.path.join(work_dir, 'segment-{}.mkv'.format(i))
+            ffmpeg_runner.convert_video(segment.video_file, video_file, video_params, segment.video_start, segment.duration)
+            segment.video_file, segment.video_start = video_file, None
+        if segment.audio_params != audio_params:
+            print("Warning: audio of {} doesn't match the other games, re-encoding it".format(segment.audio_file))
+            audio_file = os.path.join(work_dir, 'segment-{}.wav'.format(i))
+            ffmpeg_runner.convert_audio(segment.audio_file, audio_file, audio_params, segment.audio_start, segment.duration)
+            segment.audio_file, segment.audio_start = audio_file, None
+
+
+def combine_dumps(ffmpeg_runner, dumps_list, outfile, work_dir):
+    """
+    Mux and concatenate the games in dumps_list (dolphinrunner.Dumps, in order) into outfile
+    Temporary files are written to work_dir. The dumps aren't released
+    """
+    segments = [Segment(dumps) for dumps in dumps_list]
+    if ffmpeg_runner.ffprobe_bin is None:
+        print("Warning: ffprobe not found, combining without checking that every game's dumps match")
+    else:
+        probe_segments(ffmpeg_runner, segments)
+        convert_mismatched(ffmpeg_runner, segments, work_dir)
+
+    video_list = os.path.join(work_dir, 'video_concat.txt')
+    audio_list = os.path.join(work_dir, 'audio_concat.txt')
+    ffmpeg_runner.write_concat_list(video_list, [(s.video_file, s.video_start, s.duration) for s in segments])
+    ffmpeg_runner.write_concat_list(audio_list, [(s.audio_file, s.audio_start, s.duration) for s in segments])
+    ffmpeg_runner.concat_dumps(video_list, audio_list, outfile)
+    os.remove(video_list)
+    os.remove(audio_list)
@@ -1,37 +1,220 @@
-import subprocess
+import os, sys, json, shutil, subprocess
+import cancellation
+
+
+def find_ffprobe(ffmpeg_bin):
+    """
+    ffprobe is normally installed next to ffmpeg. Returns None if it can't be found
+    """
+    name = 'ffprobe.exe' if sys.platform == 'win32' else 'ffprobe'
+    ffprobe = os.path.join(os.path.dirname(ffmpeg_bin), name)
+    if os.path.exists(ffprobe):
+        return ffprobe
+    return shutil.which(name)
+
+
+def concat_path(path):
+    # Quote a path for an ffconcat file
+    return "'" + path.replace("'", "'\\''") + "'"
+
 
 class FfmpegRunner:
     def __init__(self, ffmpeg_bin):
         self.ffmpeg_bin = ffmpeg_bin
+        self.ffprobe_bin = find_ffprobe(ffmpeg_bin)
+
+    def probe(self, path):
+        """
+        Returns {'duration': seconds or None, 'streams': [{codec_type, codec_name, width, ...}]} for a media file
+        """
+        cmd = [
+            self.ffprobe_bin,
+            '-v', 'error',
+            '-show_entries', 'format=duration:stream=codec_type,codec_name,width,height,pix_fmt,r_frame_rate,sample_rate,channels',
+            '-of', 'json',
+            path
+            ]
+        proc_ffprobe = subprocess.run(cmd, stdout=subprocess.PIPE)
+        if proc_ffprobe.returncode != 0:
+            raise RuntimeError("ffprobe failed with exit code {} reading {}".format(proc_ffprobe.returncode, path))
+        info = json.loads(proc_ffprobe.stdout)
+        duration = info.get('format', {}).get('duration')
+        return {
+            'duration': float(duration) if duration not in (None, 'N/A') else None,
+            'streams': info.get('streams', []),
+        }
+
+    def run_ffmpeg(self, cmd, outfile):
+        """
+        Run ffmpeg, writing to a temporary file that is renamed to outfile once ffmpeg succeeds
+        This way an interrupted run never leaves a half-written outfile behind
+        Raises cancellation.Cancelled if the job is cancelled, which terminates ffmpeg
+        """
+        self.run_ffmpeg_outputs(cmd, [([], outfile)])
+
+    def run_ffmpeg_outputs(self, cmd, outputs):
+        """
+        Like run_ffmpeg, for an ffmpeg run that writes several files. outputs is a list of (output options, outfile)
+        The files are renamed in order once ffmpeg succeeds, so the last one only exists if they all do
+        """
+        cmd = list(cmd)
+        tmp_outfiles = []
+        for options, outfile in outputs:
+            _, ext = os.path.splitext(outfile)
+            tmp_outfile = outfile + '.part'
+            cmd += options + [
+                '-f', ext[1:],          # the .part extension hides the format from ffmpeg
+                tmp_outfile
+                ]
+            tmp_outfiles.append(tmp_outfile)
+        print(' '.join(cmd))
+        proc_ffmpeg = subprocess.Popen(args=cmd)
+        with cancellation.tracking(proc_ffmpeg):
+            proc_ffmpeg.wait()
+        if proc_ffmpeg.returncode != 0:
+            for tmp_outfile in tmp_outfiles:
+                if os.path.exists(tmp_outfile):
+                    os.remove(tmp_outfile)
+            cancellation.check()
+            raise RuntimeError("ffmpeg failed with exit code {} creating {}".format(proc_ffmpeg.returncode,
+                                                                                   outputs[-1][1]))
+        for tmp_outfile, (_, outfile) in zip(tmp_outfiles, outputs):
+            os.replace(tmp_outfile, outfile)
 
     def combine(self, concat_file, outfile):
         cmd = [
             self.ffmpeg_bin,
+            '-y',                       # overwrite the temporary file left by an interrupted run
             '-safe', '0',
             '-f', 'concat',             # Set input stream to concatenate
             '-i', concat_file,          # use a concatenation demuxer file which contains a list of files to combine
             '-c', 'copy',               # copy audio and video
-            outfile
             ]
-        print(' '.join(cmd))
-        proc_ffmpeg = subprocess.Popen(args=cmd)
-        proc_ffmpeg.wait()
+        self.run_ffmpeg(cmd, outfile)
 
-    def run(self, video_file, audio_file, outfile):
+    def run(self, video_file, audio_file, outfile, video_start=None, audio_start=None, duration=None, variants=()):
+        """
+        video_start, audio_start and duration (seconds) select part of the dumps, for dumps holding more than one game
+        variants is a list of (outfile, height, bitrate_kbps) to scale and encode the video to, in the same ffmpeg run
+        """
+        audio_input = ['-i', audio_file]
+        video_input = ['-i', video_file]
+        if audio_start is not None:
+            audio_input = ['-ss', str(audio_start)] + audio_input
+        if video_start is not None:
+            video_input = ['-ss', str(video_start)] + video_input
 
         cmd = [
             self.ffmpeg_bin,
             '-y',                   # overwrite output file without asking
-            '-i', audio_file,       # 0th input stream: audio
+            *audio_input,           # 0th input stream: audio
             # offset no longer needed!
             #'-itsoffset', '1.55',   # offset (delay) the audio by 1.55s
-            '-i', video_file,  # 1st input stream: video
+            *video_input,           # 1st input stream: video
+            ]
+        output = [
             '-map', '1:v',          # map 1st input to video output
             '-map', '0:a',          # map 0th input to audio output
             '-c:a', 'mp3',          # convert audio encoding to mp3 for output
             '-c:v', 'copy',         # use the same encoding (avi) for video output
-            outfile
             ]
-        print(' '.join(cmd))
-        proc_ffmpeg = subprocess.Popen(args=cmd)
-        proc_ffmpeg.wait()
\ No newline at end of file
+        if duration is not None:
+            output += ['-t', str(duration)]
+        if not variants:
+            self.run_ffmpeg(cmd + output, outfile)
+            return
+
+        # The video is decoded once and split, one scaled copy per variant. The main video is still copied
+        labels = ['[v{}]'.format(i) for i in range(len(variants))]
+        graph = ['[1:v]split={}{}'.format(len(variants), ''.join(labels))]
+        for i, (_, height, _) in enumerate(variants):
+            graph.append('{}scale=-2:{}[s{}]'.format(labels[i], height, i))
+        cmd += ['-filter_complex', ';'.join(graph)]
+        outputs = []
+        for i, (variant_file, _, bitrate_kbps) in enumerate(variants):
+            variant_output = [
+                '-map', '[s{}]'.format(i),
+                '-map', '0:a',
+                '-c:a', 'mp3',
+                '-c:v', 'libx264',
+                '-b:v', '{}k'.format(bitrate_kbps),
+                '-pix_fmt', 'yuv420p',
+                ]
+            if duration is not None:
+                variant_output += ['-t', str(duration)]
+            outputs.append((variant_output, variant_file))
+        # Last, so the main video only exists once every variant does
+        outputs.append((output, outfile))
+        self.run_ffmpeg_outputs(cmd, outputs)
+
+    def write_concat_list(self, list_file, segments):
+        """
+        segments is a list of (file, start, duration), start and duration in seconds or None for the whole file
+        """
+        with open(list_file, 'w') as f:
+            f.write('ffconcat version 1.0\n')
+            for path, start, duration in segments:
+                f.write('file {}\n'.format(concat_path(path)))
+                if start:
+                    f.write('inpoint {}\n'.format(start))
+                if duration is not None:
+                    f.write('outpoint {}\n'.format((start or 0) + duration))
+
+    def concat_dumps(self, video_list, audio_list, outfile):
+        """
+        Mux and concatenate many games' dumps in one go. video_list and audio_list are ffconcat files (see
+        write_concat_list) listing each game's part of the video and audio dumps, in the same order
+        Every video segment must have the same codec parameters, the video is copied
+        """
+        cmd = [
+            self.ffmpeg_bin,
+            '-y',
+            '-safe', '0',
+            '-f', 'concat',
+            '-i', video_list,       # 0th input stream: video
+            '-safe', '0',
+            '-f', 'concat',
+            '-i', audio_list,       # 1st input stream: audio
+            '-map', '0:v',
+            '-map', '1:a',
+            '-c:a', 'mp3',
+            '-c:v', 'copy',
+            ]
+        self.run_ffmpeg(cmd, outfile)
+
+    def convert_video(self, video_file, outfile, params, start=None, duration=None):
+        """
+        Re-encode (part of) video_file to match params, a video stream from probe(), so it can be concatenated
+        with streams that have those parameters
+        """
+        cmd = [self.ffmpeg_bin, '-y']
+        if start is not None:
+            cmd += ['-ss', str(start)]
+        cmd += ['-i', video_file]
+        if duration is not None:
+            cmd += ['-t', str(duration)]
+        cmd += [
+            '-an',
+            '-vf', 'scale={}:{},fps={}'.format(params['width'], params['height'], params['r_frame_rate']),
+            '-pix_fmt', params['pix_fmt'],
+            '-c:v', params['codec_name'],
+            ]
+        self.run_ffmpeg(cmd, outfile)
+
+    def convert_audio(self, audio_file, outfile, params, start=None, duration=None):
+        """
+        Re-encode (part of) audio_file to match params, an audio stream from probe()
+        """
+        cmd = [self.ffmpeg_bin, '-y']
+        if start is not None:
+            cmd += ['-ss', str(start)]
+        cmd += ['-i', audio_file]
+        if duration is not None:
+            cmd += ['-t', str(duration)]
+        cmd += [
+            '-vn',
+            '-ar', str(params['sample_rate']),
+            '-ac', str(params['channels']),
+            '-c:a', params['codec_name'],
+            ]
+        self.run_ffmpeg(cmd, outfile)
@@ -0,0 +1,225 @@
+import os, sys, time, select, struct, ctypes, ctypes.util
+import slpscanner
+from renderprogress import IN_MODIFY, IN_CLOSE_WRITE, IN_MOVED_TO, IN_CREATE, IN_NONBLOCK, IN_CLOEXEC
+
+# Watches a replay folder for new replays during an event, where Slippi writes each game into the folder live.
+# A replay is only handed out once it's complete: Slippi fills in the length of the raw event data and writes the
+# metadata block when the game ends, so until both are there the game is still being played. A replay that never
+# gets them (Dolphin crashed, or the console was turned off mid-game) is handed out once it hasn't changed for
+# stable_seconds, and recorded as far as it goes.
+#
+# Changes are noticed with inotify on Linux, watching every subdirectory as it's created. Elsewhere, or if
+# inotify can't be used, the folder is walked every POLL_INTERVAL seconds instead.
+
+POLL_INTERVAL = 2           # seconds between walks of the folder, when polling
+CHECK_INTERVAL = 1          # seconds between checks of replays that are still being written
+
+IN_ISDIR = 0x40000000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+EVENT_HEADER = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+
+
+def find_replays(folder):
+    """
+    Returns {path: (size, mtime_ns)} for every .slp file under folder
+    """
+    found = {}
+    for subdir, dirs, files in os.walk(folder):
+        for file in files:
+            if file.endswith('.slp'):
+                path = os.path.join(subdir, file)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found[path] = (st.st_size, st.st_mtime_ns)
+    return found
+
+
+class InotifyTree:
+    """
+    Reports the .slp files that were created or written to anywhere under a directory
+    """
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self, folder):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # watch descriptor -> directory
+        self.dirs = {}
+        try:
+            self.add_tree(folder)
+        except OSError:
+            os.close(self.fd)
+            raise
+        self.folder = folder
+
+    def add_dir(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed for {}".format(directory))
+        self.dirs[wd] = directory
+
+    def add_tree(self, folder):
+        """
+        Watch folder and its subdirectories. Returns the .slp files in them, they may have been written before
+        the watches were in place
+        """
+        found = []
+        for subdir, dirs, files in os.walk(folder):
+            self.add_dir(subdir)
+            found.extend(os.path.join(subdir, file) for file in files if file.endswith('.slp'))
+        return found
+
+    def changes(self, timeout):
+        """
+        Wait up to timeout seconds for changes. Returns the paths of the .slp files that changed
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return set()
+        changed = set()
+        try:
+            while True:
+                data = os.read(self.fd, READ_SIZE)
+                pos = 0
+                while pos < len(data):
+                    wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, pos)
+                    pos += EVENT_HEADER.size
+                    name = os.fsdecode(data[pos:pos + length].rstrip(b'\0'))
+                    pos += length
+                    if mask & IN_Q_OVERFLOW:
+                        # Events were lost, anything could have changed
+                        changed.update(find_replays(self.folder))
+                        continue
+                    if mask & IN_IGNORED:
+                        self.dirs.pop(wd, None)
+                        continue
+                    directory = self.dirs.get(wd)
+                    if directory is None:
+                        continue
+                    path = os.path.join(directory, name)
+                    if mask & IN_ISDIR:
+                        if mask & (IN_CREATE | IN_MOVED_TO):
+                            try:
+                                changed.update(self.add_tree(path))
+                            except OSError as e:
+                                print("Warning: Can't watch {}: {}".format(path, e))
+                    elif name.endswith('.slp'):
+                        changed.add(path)
+        except BlockingIOError:
+            pass
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingTree:
+    """
+    Same as InotifyTree, by walking the directory
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        self.known = find_replays(folder)
+
+    def changes(self, timeout):
+        time.sleep(min(timeout, POLL_INTERVAL))
+        found = find_replays(self.folder)
+        changed = set(path for path, stat in found.items() if self.known.get(path) != stat)
+        self.known = found
+        return changed
+
+    def close(self):
+        pass
+
+
+def make_tree(folder):
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyTree(folder)
+        except (OSError, AttributeError, TypeError) as e:
+            print("Warning: can't watch {} for changes, polling instead ({})".format(folder, e))
+    return PollingTree(folder)
+
+
+class FolderWatch:
+    def __init__(self, folder, stable_seconds):
+        self.folder = folder
+        self.stable_seconds = stable_seconds
+        self.tree = None
+        # path -> when it last changed, for replays that aren't complete yet
+        self.pending = {}
+        # path -> (size, mtime_ns) of the replays handed out, so they aren't handed out again unless they change
+        self.handed_out = {}
+
+    def __enter__(self):
+        self.tree = make_tree(self.folder)
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.tree.close()
+        # Re-raise any exception that occurred in the with block
+        if tb is not None:
+            return False
+
+    def hand_out(self, path):
+        self.pending.pop(path, None)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        self.handed_out[path] = (st.st_size, st.st_mtime_ns)
+
+    def changed(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        return self.handed_out.get(path) != (st.st_size, st.st_mtime_ns)
+
+    def ready(self, path):
+        """
+        True if the replay is complete. Otherwise it's watched, and handed out by wait() once it is
+        """
+        try:
+            complete = slpscanner.is_complete(path)
+        except OSError:
+            # Deleted or moved away since the folder was walked
+            return False
+        if complete:
+            self.hand_out(path)
+            return True
+        self.pending.setdefault(path, time.monotonic())
+        return False
+
+    def wait(self, timeout=CHECK_INTERVAL):
+        """
+        Wait up to timeout seconds for replays to be complete. Returns the paths of replays that just became complete
+        Replays that were already complete when they were first seen are handed out straight away
+        """
+        now = time.monotonic()
+        for path in self.tree.changes(timeout):
+            if self.changed(path):
+                self.pending[path] = now
+
+        done = []
+        now = time.monotonic()
+        for path, changed in list(self.pending.items()):
+            try:
+                complete = slpscanner.is_complete(path)
+            except OSError:
+                # Deleted or moved away
+                del self.pending[path]
+                continue
+            if not complete:
+                if now - changed < self.stable_seconds:
+                    continue
+                print("Warning: {} hasn't changed for {}s and has no game end, recording it as it is".format(
+                    path, self.stable_seconds))
+            self.hand_out(path)
+            done.append(path)
+        return sorted(done)
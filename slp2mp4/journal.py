@@ -0,0 +1,138 @@
+import os, time, threading, sqlite3
+from dolphinrunner import Dumps
+
+# Records the state of every job in a folder run, so a run that crashed or was killed can be restarted
+# and only do the jobs that didn't finish. Jobs are keyed by their output file.
+#
+# queued -> rendering -> rendered -> muxing -> done
+#                  \                      \
+#                   +-------> failed <-----+
+
+QUEUED = 'queued'
+RENDERING = 'rendering'
+RENDERED = 'rendered'
+MUXING = 'muxing'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA_VERSION = 1
+
+
+class JournalEntry:
+    def __init__(self, out_file, slp_file, state, attempts, error, queued_at, started_at, rendered_at,
+                 finished_at, video_file, audio_file, user_dir):
+        self.out_file = out_file
+        self.slp_file = slp_file
+        self.state = state
+        self.attempts = attempts        # number of times rendering was started
+        self.error = error              # last error, if any
+        self.queued_at = queued_at      # timestamps, seconds since the epoch
+        self.started_at = started_at
+        self.rendered_at = rendered_at
+        self.finished_at = finished_at
+        self.video_file = video_file    # dumps, kept once rendered so muxing can be resumed without re-rendering
+        self.audio_file = audio_file
+        self.user_dir = user_dir
+
+    def dumps(self):
+        """
+        Returns Dumps if the job was rendered and the dumps still exist, otherwise None
+        """
+        if self.state not in (RENDERED, MUXING):
+            return None
+        if not all(f and os.path.exists(f) for f in (self.video_file, self.audio_file)):
+            return None
+        return Dumps(self.video_file, self.audio_file, self.user_dir)
+
+
+class Journal:
+    def __init__(self, journal_path):
+        self.journal_path = journal_path
+        self.db = None
+        # Jobs are updated from the pipeline's worker threads
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        self.db = sqlite3.connect(self.journal_path, check_same_thread=False)
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.db.execute('DROP TABLE IF EXISTS jobs')
+            self.db.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                out_file TEXT PRIMARY KEY,
+                slp_file TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                queued_at REAL,
+                started_at REAL,
+                rendered_at REAL,
+                finished_at REAL,
+                video_file TEXT,
+                audio_file TEXT,
+                user_dir TEXT
+            )''')
+        self.db.commit()
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.db.close()
+        # Re-raise any exception that occurred in the with block
+        if tb is not None:
+            return False
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            self.db.execute(sql, params)
+            self.db.commit()
+
+    def get(self, out_file):
+        with self.lock:
+            row = self.db.execute(
+                'SELECT out_file, slp_file, state, attempts, error, queued_at, started_at, rendered_at, finished_at, '
+                'video_file, audio_file, user_dir FROM jobs WHERE out_file = ?', (out_file,)).fetchone()
+        if row is None:
+            return None
+        return JournalEntry(*row)
+
+    def unfinished_user_dirs(self):
+        """
+        User dirs holding dumps of rendered games that haven't been muxed yet
+        """
+        with self.lock:
+            rows = self.db.execute('SELECT user_dir FROM jobs WHERE state IN (?, ?) AND user_dir IS NOT NULL',
+                                   (RENDERED, MUXING)).fetchall()
+        return set(row[0] for row in rows)
+
+    def queued(self, job):
+        # Keep the attempt count of jobs that failed in earlier runs
+        self.execute(
+            'INSERT INTO jobs (out_file, slp_file, state, queued_at) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT(out_file) DO UPDATE SET slp_file = excluded.slp_file, state = excluded.state, '
+            'queued_at = excluded.queued_at',
+            (job.out_file, job.slp_file, QUEUED, time.time()))
+
+    def rendering(self, job):
+        self.execute('UPDATE jobs SET state = ?, attempts = attempts + 1, started_at = ?, error = NULL WHERE out_file = ?',
+                     (RENDERING, time.time(), job.out_file))
+
+    def rendered(self, job, dumps):
+        # Dumps shared with other games (from a persistent Dolphin) are removed with their Dolphin, so they can't be resumed
+        if dumps.is_shared():
+            video_file, audio_file, user_dir = None, None, None
+        else:
+            video_file, audio_file, user_dir = dumps.video_file, dumps.audio_file, dumps.user_dir
+        self.execute('UPDATE jobs SET state = ?, rendered_at = ?, video_file = ?, audio_file = ?, user_dir = ? '
+                     'WHERE out_file = ?', (RENDERED, time.time(), video_file, audio_file, user_dir, job.out_file))
+
+    def muxing(self, job):
+        self.execute('UPDATE jobs SET state = ? WHERE out_file = ?', (MUXING, job.out_file))
+
+    def done(self, job):
+        self.execute('UPDATE jobs SET state = ?, finished_at = ?, video_file = NULL, audio_file = NULL, user_dir = NULL '
+                     'WHERE out_file = ?', (DONE, time.time(), job.out_file))
+
+    def failed(self, job, error):
+        self.execute('UPDATE jobs SET state = ?, finished_at = ?, error = ?, video_file = NULL, audio_file = NULL, '
+                     'user_dir = NULL WHERE out_file = ?', (FAILED, time.time(), error, job.out_file))
@@ -0,0 +1,130 @@
+import os, json, time, shutil, hashlib, threading, sqlite3
+
+# Cache of recorded videos, keyed by the replay's content hash and a fingerprint of everything else that affects the
+# video (resolution, widescreen, bitrate, the Dolphin build and the ISO). The same replay copied into another
+# folder, or a folder that was reorganized, gets its video from the cache instead of being rendered again.
+#
+# Videos are hardlinked in and out of the cache where possible, so a cached video costs no extra space while its
+# output still exists. When the cache grows past its size limit, the least recently used videos are removed.
+
+SCHEMA_VERSION = 1
+# Change when slp-to-mp4 changes how videos are made, so old videos aren't used
+CACHE_VERSION = 1
+
+
+def file_identity(path):
+    # Hashing the ISO or Dolphin on every run would take too long, size and mtime change with them
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def fingerprint(conf):
+    """
+    Hash of the settings that affect the recorded video
+    """
+    settings = {
+        'version': CACHE_VERSION,
+        'resolution': conf.resolution,
+        'widescreen': conf.widescreen,
+        'bitrateKbps': conf.bitrateKbps,
+        'dolphin': file_identity(conf.dolphin_bin),
+        'iso': file_identity(conf.melee_iso),
+    }
+    return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+def link_or_copy(src, dst):
+    """
+    Hardlink src to dst, or copy it if that's not possible (e.g. different filesystems). dst is replaced atomically
+    """
+    tmp_dst = dst + '.part'
+    if os.path.exists(tmp_dst):
+        os.remove(tmp_dst)
+    try:
+        os.link(src, tmp_dst)
+    except OSError:
+        shutil.copyfile(src, tmp_dst)
+    os.replace(tmp_dst, dst)
+
+
+class OutputCache:
+    def __init__(self, cache_dir, max_bytes, settings_fingerprint):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.fingerprint = settings_fingerprint
+        self.db = None
+        # Used from the pipeline's worker threads
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(self.cache_dir, 'cache.db'), check_same_thread=False)
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.db.execute('DROP TABLE IF EXISTS videos')
+            self.db.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS videos (
+                key TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )''')
+        self.db.commit()
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.db.close()
+        # Re-raise any exception that occurred in the with block
+        if tb is not None:
+            return False
+
+    def key(self, replay_sha1):
+        return hashlib.sha1('{}:{}'.format(replay_sha1, self.fingerprint).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + '.mp4')
+
+    def get(self, key, out_file):
+        """
+        Put the cached video for key at out_file
+        Returns False if there is no cached video for key
+        """
+        with self.lock:
+            row = self.db.execute('SELECT size FROM videos WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return False
+            if not os.path.exists(self.path(key)):
+                self.db.execute('DELETE FROM videos WHERE key = ?', (key,))
+                self.db.commit()
+                return False
+            self.db.execute('UPDATE videos SET last_used = ? WHERE key = ?', (time.time(), key))
+            self.db.commit()
+            link_or_copy(self.path(key), out_file)
+        return True
+
+    def put(self, key, out_file):
+        """
+        Add a recorded video to the cache, then remove the least recently used videos if the cache is too big
+        """
+        size = os.path.getsize(out_file)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            link_or_copy(out_file, self.path(key))
+            self.db.execute('INSERT OR REPLACE INTO videos (key, size, last_used) VALUES (?, ?, ?)',
+                            (key, size, time.time()))
+            self.db.commit()
+            self.evict()
+
+    def evict(self):
+        total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM videos').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.db.execute('SELECT key, size FROM videos ORDER BY last_used').fetchall():
+            if total <= self.max_bytes:
+                break
+            if os.path.exists(self.path(key)):
+                os.remove(self.path(key))
+            self.db.execute('DELETE FROM videos WHERE key = ?', (key,))
+            total -= size
+        self.db.commit()
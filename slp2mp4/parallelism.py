@@ -0,0 +1,98 @@
+import threading, time
+import renderprogress
+
+# Adjusts how many games render at the same time, based on the render rate of the games that are running.
+# Dolphin drops frames when it can't keep up with 60 FPS, so as long as every game renders at or above the
+# FPS floor another game is allowed to start; when any game falls below it, one fewer game is allowed.
+# A game that is already running is never stopped - a lower limit takes effect as games finish.
+
+CONTROL_INTERVAL = 2        # seconds between checks
+INCREASE_COOLDOWN = 15      # seconds to wait after a change before allowing another game, so new games can settle
+DECREASE_COOLDOWN = 10      # seconds to wait after a change before removing another game
+FPS_HEADROOM = 1            # games must be this far above the floor before another game is added
+
+
+class Slots:
+    """
+    A semaphore whose limit can be changed while it's in use
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self.cond = threading.Condition()
+
+    def set_limit(self, limit):
+        with self.cond:
+            self.limit = limit
+            self.cond.notify_all()
+
+    def acquire(self):
+        with self.cond:
+            while self.in_use >= self.limit:
+                self.cond.wait()
+            self.in_use += 1
+
+    def release(self):
+        with self.cond:
+            self.in_use -= 1
+            self.cond.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.release()
+        # Re-raise any exception that occurred in the with block
+        if tb is not None:
+            return False
+
+
+class AdaptiveParallelism:
+    def __init__(self, initial_games, max_games, fps_floor, min_games=1):
+        self.min_games = min_games
+        self.max_games = max_games
+        self.fps_floor = fps_floor
+        self.slots = Slots(max(min_games, min(initial_games, max_games)))
+
+        self.last_change = time.perf_counter()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.control_loop, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.stopping.set()
+        self.thread.join()
+        # Re-raise any exception that occurred in the with block
+        if tb is not None:
+            return False
+
+    def control_loop(self):
+        while not self.stopping.wait(CONTROL_INTERVAL):
+            rates = [p.fps() for p in renderprogress.live_progress()]
+            self.adjust([rate for rate in rates if rate is not None])
+
+    def adjust(self, rates):
+        """
+        rates is the measured FPS of each game that has been rendering long enough to measure
+        """
+        now = time.perf_counter()
+        since_change = now - self.last_change
+        limit = self.slots.limit
+
+        if any(rate < self.fps_floor for rate in rates):
+            if limit > self.min_games and since_change >= DECREASE_COOLDOWN:
+                self.set_limit(limit - 1, "slowest game is rendering at {:.1f} FPS".format(min(rates)))
+        # Only add a game if every slot is busy and measured, otherwise we don't know it would be fine
+        elif len(rates) >= limit and limit < self.max_games and since_change >= INCREASE_COOLDOWN:
+            if min(rates) >= self.fps_floor + FPS_HEADROOM:
+                self.set_limit(limit + 1, "slowest game is rendering at {:.1f} FPS".format(min(rates)))
+
+    def set_limit(self, limit, reason):
+        print("Adaptive parallelism: {} -> {} games ({})".format(self.slots.limit, limit, reason))
+        self.slots.set_limit(limit)
+        self.last_change = time.perf_counter()
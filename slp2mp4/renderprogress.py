@@ -0,0 +1,225 @@
+import os, sys, select, time, threading, collections, ctypes, ctypes.util
+
+# Track how many frames Dolphin has rendered by tailing Logs/render_time.txt (one line per frame).
+# Only bytes written since the last check are read, and waiting wakes up as soon as the file changes
+# (inotify on Linux, polling elsewhere) or Dolphin exits.
+
+POLL_INTERVAL = 0.25        # seconds, used when inotify or pidfd aren't available
+FPS_WINDOW = 5              # seconds of history used to measure render rate
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+class InotifyWatcher:
+    """
+    Wakes up when a file in a directory is created or written to
+    """
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch failed for {}".format(directory))
+
+    def fileno(self):
+        return self.fd
+
+    def drain(self):
+        # We don't care what the events were, only that something changed
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_watcher(directory):
+    """
+    Returns an InotifyWatcher, or None if inotify isn't available and we have to poll
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        return InotifyWatcher(directory)
+    except (OSError, AttributeError, TypeError) as e:
+        print("Warning: can't watch {} for changes, polling instead ({})".format(directory, e))
+        return None
+
+
+def open_pidfd(proc):
+    """
+    Returns a file descriptor that becomes readable when proc exits, or None if the OS can't do that
+    """
+    if proc is None or not hasattr(os, 'pidfd_open'):
+        return None
+    try:
+        return os.pidfd_open(proc.pid)
+    except OSError:
+        return None
+
+
+# Every RenderProgress currently in use, so the render rate of all running games can be monitored
+live_lock = threading.Lock()
+live = set()
+
+
+def live_progress():
+    with live_lock:
+        return list(live)
+
+
+class RenderProgress:
+    def __init__(self, render_time_file, proc=None):
+        self.render_time_file = render_time_file
+        self.proc = proc
+        self.offset = 0
+        self.frames = 0
+        self.watcher = None
+        self.pidfd = None
+        # True while someone is waiting for a game to render, as opposed to e.g. a persistent Dolphin waiting for work
+        self.active = False
+        # (time, frames) whenever new frames were seen, going back FPS_WINDOW seconds
+        self.samples = collections.deque()
+        # The game being rendered while active, and the frame counts it starts and ends at, for status reports
+        self.slp_file = None
+        self.game_start_frames = 0
+        self.game_end_frames = None
+        # Stats for the current game, since it was made active
+        self.first_sample = None
+        self.last_sample = None
+        self.min_fps = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.render_time_file), exist_ok=True)
+        self.watcher = make_watcher(os.path.dirname(self.render_time_file))
+        self.pidfd = open_pidfd(self.proc)
+        with live_lock:
+            live.add(self)
+        return self
+
+    def __exit__(self, type, value, tb):
+        with live_lock:
+            live.discard(self)
+        if self.watcher is not None:
+            self.watcher.close()
+        if self.pidfd is not None:
+            os.close(self.pidfd)
+        # Re-raise any exception that occurred in the with block
+        if tb is not None:
+            return False
+
+    def update(self):
+        """
+        Read whatever has been appended to the render time file since the last update
+        Returns the total number of frames rendered
+        """
+        try:
+            with open(self.render_time_file, 'rb') as f:
+                # File was recreated - start again from the beginning
+                if os.fstat(f.fileno()).st_size < self.offset:
+                    self.offset = 0
+                    self.frames = 0
+                f.seek(self.offset)
+                data = f.read()
+        except FileNotFoundError:
+            return self.frames
+
+        # Only count complete lines, the rest will be read next time
+        last_newline = data.rfind(b'\n')
+        if last_newline >= 0:
+            self.frames += data.count(b'\n', 0, last_newline + 1)
+            self.offset += last_newline + 1
+            if self.active:
+                self.add_sample(time.perf_counter())
+        return self.frames
+
+    def add_sample(self, now):
+        sample = (now, self.frames)
+        self.samples.append(sample)
+        # Keep the last sample from before the window, it's the frame count at the start of the window
+        while len(self.samples) > 2 and self.samples[1][0] <= now - FPS_WINDOW:
+            self.samples.popleft()
+
+        if self.first_sample is None:
+            self.first_sample = sample
+        self.last_sample = sample
+        start_time, start_frames = self.samples[0]
+        if now - start_time >= FPS_WINDOW:
+            fps = (self.frames - start_frames) / (now - start_time)
+            if self.min_fps is None or fps < self.min_fps:
+                self.min_fps = fps
+
+    def set_active(self, active, slp_file=None, end_frames=None):
+        """
+        Active while someone waits for slp_file to render, which is done once end_frames have been rendered
+        """
+        self.active = active
+        self.samples.clear()
+        if active:
+            self.first_sample = None
+            self.last_sample = None
+            self.min_fps = None
+            self.slp_file = slp_file
+            self.game_start_frames = self.frames
+            self.game_end_frames = end_frames
+
+    def mean_fps(self):
+        """
+        Average render rate of the current game, from its first frame to its last
+        Can be called from any thread, the render thread may start a new game meanwhile
+        """
+        first_sample, last_sample = self.first_sample, self.last_sample
+        if first_sample is None or last_sample is None or last_sample[0] <= first_sample[0]:
+            return None
+        return (last_sample[1] - first_sample[1]) / (last_sample[0] - first_sample[0])
+
+    def fps(self):
+        """
+        Frames rendered per second over the last FPS_WINDOW seconds
+        Returns None if the game hasn't been rendering for that long yet. Time spent loading before the
+        first frame doesn't count
+        """
+        if not self.active:
+            return None
+        now = time.perf_counter()
+        try:
+            start_time, start_frames = self.samples[0]
+        except IndexError:
+            return None
+        # The first sample can be older than the window if we haven't seen new frames for a while
+        if now - start_time < FPS_WINDOW:
+            return None
+        return (self.frames - start_frames) / (now - start_time)
+
+    def dolphin_exited(self):
+        return self.proc is not None and self.proc.poll() is not None
+
+    def wait(self, timeout):
+        """
+        Sleep until the render time file changes, Dolphin exits, or timeout seconds pass
+        """
+        fds = [fd for fd in (self.watcher, self.pidfd) if fd is not None]
+        # Without a pidfd we can only notice Dolphin exiting by polling it
+        if self.pidfd is None:
+            timeout = min(timeout, POLL_INTERVAL)
+        if self.watcher is None:
+            timeout = min(timeout, POLL_INTERVAL)
+
+        if not fds:
+            time.sleep(timeout)
+            return
+        readable, _, _ = select.select(fds, [], [], max(timeout, 0))
+        if self.watcher in readable:
+            self.watcher.drain()
@@ -0,0 +1,183 @@
+import os, json, time, struct, hashlib, sqlite3, multiprocessing
+import slpscanner
+
+# On-disk index of scanned replays, so a folder run only has to scan files that are new or changed.
+# Entries are keyed by path and are valid as long as the file's size and mtime haven't changed.
+
+SCHEMA_VERSION = 1
+HASH_CHUNK_SIZE = 1024 * 1024
+# Below this many changed files it's quicker to scan them here than to start a pool
+MIN_PARALLEL_SCAN = 16
+
+
+class IndexEntry:
+    def __init__(self, path, size, mtime_ns, sha1, duration, players, stage, too_short, error):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.sha1 = sha1            # hash of the replay contents
+        self.duration = duration    # number of frames, None if the replay couldn't be read
+        self.players = players      # list of dicts, see slpscanner.Player.to_dict
+        self.stage = stage
+        self.too_short = too_short
+        self.error = error          # why the replay couldn't be read, None if it's fine
+        self.scan_seconds = None    # how long scanning it took, if it was scanned rather than loaded from the index
+
+    def should_skip(self, remove_short):
+        return self.error is not None or (self.too_short and remove_short)
+
+
+def find_replays(slp_folder):
+    """
+    Walk slp_folder in os.walk order
+    Returns [(path, size, mtime_ns)] for every .slp file that can be read
+    """
+    found = []
+    for subdir, dirs, files in os.walk(slp_folder):
+        for file in files:
+            if file.endswith('.slp'):
+                path = os.path.join(subdir, file)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    # A broken symlink, or removed since the walk
+                    continue
+                found.append((path, st.st_size, st.st_mtime_ns))
+    return found
+
+
+def hash_file(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def scan_replay(path, size, mtime_ns, min_game_length):
+    """
+    Scan a single replay for the index. Runs in a worker process
+    """
+    start = time.perf_counter()
+    try:
+        sha1 = hash_file(path)
+        info = slpscanner.scan(path)
+    except (OSError, RuntimeError, struct.error) as e:
+        return IndexEntry(path, size, mtime_ns, None, None, [], None, False, str(e))
+    players = [p.to_dict() for p in info.players]
+    entry = IndexEntry(path, size, mtime_ns, sha1, info.duration, players, info.stage,
+                       info.duration < min_game_length, None)
+    entry.scan_seconds = time.perf_counter() - start
+    return entry
+
+
+def scan_replay_args(args):
+    return scan_replay(*args)
+
+
+class ReplayIndex:
+    def __init__(self, index_path, min_game_length):
+        self.index_path = index_path
+        self.min_game_length = min_game_length
+        self.db = None
+
+    def __enter__(self):
+        self.db = sqlite3.connect(self.index_path)
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.db.execute('DROP TABLE IF EXISTS replays')
+            self.db.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS replays (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha1 TEXT,
+                duration INTEGER,
+                players TEXT NOT NULL,
+                stage INTEGER,
+                min_game_length INTEGER NOT NULL,
+                too_short INTEGER NOT NULL,
+                error TEXT
+            )''')
+        self.db.commit()
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.db.close()
+        # Re-raise any exception that occurred in the with block
+        if tb is not None:
+            return False
+
+    def load_folder(self, slp_folder):
+        """
+        Returns {path: IndexEntry} for every indexed replay under slp_folder
+        """
+        # Compared exactly, LIKE ignores case and would need its wildcards escaped
+        prefix = os.path.join(slp_folder, '')
+        entries = {}
+        rows = self.db.execute(
+            'SELECT path, size, mtime_ns, sha1, duration, players, stage, too_short, error, min_game_length '
+            'FROM replays WHERE substr(path, 1, ?) = ?', (len(prefix), prefix))
+        for row in rows:
+            # Entries scanned with a different minimum game length need their too_short decision redone
+            if row[9] != self.min_game_length:
+                continue
+            entries[row[0]] = IndexEntry(row[0], row[1], row[2], row[3], row[4], json.loads(row[5]), row[6],
+                                         bool(row[7]), row[8])
+        return entries
+
+    def store(self, entries):
+        self.db.executemany(
+            'INSERT OR REPLACE INTO replays '
+            '(path, size, mtime_ns, sha1, duration, players, stage, min_game_length, too_short, error) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(e.path, e.size, e.mtime_ns, e.sha1, e.duration, json.dumps(e.players), e.stage,
+              self.min_game_length, int(e.too_short), e.error) for e in entries])
+        self.db.commit()
+
+    def forget(self, paths):
+        self.db.executemany('DELETE FROM replays WHERE path = ?', [(path,) for path in paths])
+        self.db.commit()
+
+    def scan_file(self, path):
+        """
+        Scan a single replay, e.g. one that was just written, and add it to the index
+        Returns its IndexEntry
+        """
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        entry = scan_replay(path, st.st_size, st.st_mtime_ns, self.min_game_length)
+        self.store([entry])
+        return entry
+
+    def scan_folder(self, slp_folder, num_processes=None):
+        """
+        Bring the index up to date for every replay in slp_folder, scanning only new or changed files
+        Returns [IndexEntry] in os.walk order
+        """
+        slp_folder = os.path.abspath(slp_folder)
+        found = find_replays(slp_folder)
+        known = self.load_folder(slp_folder)
+
+        to_scan = []
+        for path, size, mtime_ns in found:
+            entry = known.get(path)
+            if entry is None or entry.size != size or entry.mtime_ns != mtime_ns:
+                to_scan.append((path, size, mtime_ns, self.min_game_length))
+
+        if to_scan:
+            print("Scanning {} new or changed replays ({} unchanged)".format(len(to_scan), len(found) - len(to_scan)))
+            if len(to_scan) < MIN_PARALLEL_SCAN:
+                scanned = [scan_replay(*args) for args in to_scan]
+            else:
+                with multiprocessing.Pool(processes=num_processes) as pool:
+                    scanned = list(pool.imap_unordered(scan_replay_args, to_scan, chunksize=8))
+            self.store(scanned)
+            for entry in scanned:
+                known[entry.path] = entry
+
+        # Forget replays that were deleted or moved since the last run
+        found_paths = set(path for path, _, _ in found)
+        self.forget([path for path in known if path not in found_paths])
+        return [known[path] for path, _, _ in found]
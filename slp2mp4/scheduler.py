@@ -0,0 +1,413 @@
+import os, time, threading, queue, traceback, contextlib, collections
+from concurrent.futures import ThreadPoolExecutor
+import telemetry, cancellation
+
+# Runs batches of games through two stages:
+#   render - Dolphin plays the replay and dumps frames and audio
+#   post   - ffmpeg muxes the dumps into an mp4
+# Each stage has its own pool of workers, connected by a bounded queue of finished dumps, so a Dolphin slot is
+# free to start the next game while the previous one is being muxed. The workers are threads because all they do
+# is babysit a Dolphin or ffmpeg subprocess.
+#
+# Each job gets a cancellation.Token, so a job that runs longer than job_timeout is stopped and failed, and
+# cancel() (or Ctrl-C) stops the whole run: running Dolphins and ffmpegs are terminated and no new games are
+# started. Cancelled jobs are left unfinished in the journal, so the next run picks them up again.
+#
+# Once every job in a group is finished, on_group_done runs on a thread of its own (e.g. to combine the group's
+# videos), so post workers go back to muxing straight away and Dolphins don't wait on a full queue meanwhile.
+#
+# Render threads take the next job as soon as they're free, longest job first (by each job's cost, its expected
+# render time), so a long game isn't left to run on its own at the end while the other threads sit idle.
+
+# The states a job goes through, as recorded in the journal
+STATES = ('queued', 'rendering', 'rendered', 'muxing', 'done', 'failed')
+
+
+class Job:
+    def __init__(self, slp_file, out_file, duration):
+        self.slp_file = slp_file
+        self.out_file = out_file
+        self.duration = duration                    # number of frames in the replay
+        self.group = os.path.dirname(out_file)      # games in the same output directory are combined together
+        self.dumps = None                           # set if the game was rendered by an earlier run, skips rendering
+        self.metrics = None                         # telemetry for this job, if it's being recorded
+        self.parse_seconds = None                   # time spent scanning the replay before the job, if it was
+        self.cache_key = None                       # key of the job's video in the output cache, if there is one
+        self.waits_for = None                       # threading.Event to wait for before rendering, if any
+        self.finished = threading.Event()           # for other jobs to wait for, set once the job succeeds or fails
+        self.token = None                           # cancellation.Token for this job, while it's running
+        self.cost = duration                        # expected render time, in any unit as long as every job uses it
+        self.disk_bytes = 0                         # estimated size of the job's dumps
+
+
+def schedule_order(jobs):
+    """
+    Returns jobs in the order to render them. Games rendered by an earlier run go first, they only need a moment to
+    hand their dumps over. Games that wait for another job go last, they hold a render thread while waiting.
+    The rest go longest first
+    """
+    return sorted(jobs, key=lambda job: (job.dumps is None, job.waits_for is not None, -job.cost))
+
+
+def format_seconds(seconds):
+    seconds = int(seconds)
+    return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class Eta:
+    """
+    Estimates how long is left of a run from the cost of the jobs that are left, with job costs in seconds
+    Until a job per worker has finished, each worker is assumed to get through one second of cost per second. After
+    that the rate so far is used
+    """
+    def __init__(self, jobs=(), num_workers=None):
+        self.total_cost = 0
+        self.longest = 0
+        self.num_jobs = 0
+        self.num_workers = num_workers
+        self.done_cost = 0
+        self.num_done = 0
+        self.start = time.perf_counter()
+        for job in jobs:
+            self.add(job)
+
+    def add(self, job):
+        self.total_cost += job.cost
+        self.longest = max(self.longest, job.cost)
+        self.num_jobs += 1
+
+    def finished(self, job):
+        self.done_cost += job.cost
+        self.num_done += 1
+
+    def seconds_left(self):
+        """
+        Returns None if there is nothing to go on yet
+        """
+        left = self.total_cost - self.done_cost
+        elapsed = time.perf_counter() - self.start
+        if self.num_done >= (self.num_workers or 1) and self.done_cost > 0:
+            return left * elapsed / self.done_cost
+        if self.num_workers is None:
+            return None
+        # The run can't take less than its longest job
+        return max(self.total_cost / self.num_workers, self.longest) - elapsed
+
+    def left(self):
+        seconds = self.seconds_left()
+        if seconds is None:
+            return "estimating time left"
+        return "about {} left".format(format_seconds(max(seconds, 0)))
+
+    def status(self):
+        return "Finished {}/{} games, {}".format(self.num_done, self.num_jobs, self.left())
+
+
+class Pipeline:
+    def __init__(self, render, post, num_renderers, num_post, queue_size, on_group_done=None, journal=None, slots=None,
+                 metrics=None, keep_rendered=False, job_timeout=None, retries=0, retry_backoff=0, retry_errors=(),
+                 disk_space=None, on_job_done=None):
+        """
+        render(job) runs Dolphin and returns the dumps to pass to post(job, dumps), or None if there is nothing
+        to post-process. post takes over the dumps, unless it raises cancellation.Cancelled because the whole run
+        was cancelled. Dumps that don't get to post are released here, unless the journal keeps them for the next run
+        on_group_done(group, failed) is called once every job in a group is finished, on one of num_post threads
+        of its own
+        journal, if given, is a journal.Journal that every job's progress is recorded in
+        slots, if given, is a parallelism.Slots that limits how many of the num_renderers render at once
+        metrics, if given, is a telemetry.Telemetry that every job's metrics are written to
+        keep_rendered leaves jobs unfinished in the journal after post, for when post holds on to the dumps to use
+        them later (e.g. once the group is done). Whoever uses them marks the jobs done in the journal
+        job_timeout, if given, is how many seconds a job may take from getting a render slot to the end of post.
+        Time spent waiting for a slot, for disk space or for a duplicate doesn't count, and each render attempt
+        gets the full time again
+        A render that raises one of retry_errors is tried again up to retries times, after retry_backoff seconds,
+        doubling each time. The render slot is free while waiting
+        disk_space, if given, is a diskspace.DiskSpace that jobs must be admitted by before they take a slot
+        on_job_done(job, ok, error) is called as each job is finished
+        """
+        self.render = render
+        self.post = post
+        self.num_renderers = num_renderers
+        self.num_post = num_post
+        self.on_group_done = on_group_done
+        self.journal = journal
+        self.slots = slots
+        self.metrics = metrics
+        self.keep_rendered = keep_rendered
+        self.job_timeout = job_timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.retry_errors = retry_errors
+        self.disk_space = disk_space
+        self.on_job_done = on_job_done
+        self.token = cancellation.Token()
+
+        self.dumps = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.remaining = {}
+        self.failed_groups = set()
+        self.failed_jobs = []
+        self.eta = Eta(num_workers=num_renderers)
+        # job -> its state, for status reports
+        self.states = {}
+        self.render_pool = None
+        self.post_threads = []
+        self.group_pool = None
+
+    def record(self, state, job, *args):
+        with self.lock:
+            self.states[job] = state
+        if self.journal is not None:
+            getattr(self.journal, state)(job, *args)
+
+    def finish(self, job, ok, error=None, held=False):
+        """
+        held means the job's dumps are still in use after post, so the journal keeps them for resuming
+        """
+        if job.token is not None:
+            job.token.close()
+        if self.disk_space is not None:
+            self.disk_space.release(job)
+        if not ok:
+            self.record('failed', job, error)
+        elif not held:
+            self.record('done', job)
+        if self.metrics is not None:
+            self.metrics.finish_job(job.metrics, ok, error)
+
+        with self.lock:
+            # Held jobs aren't done in the journal yet, but they are as far as the pipeline is concerned
+            self.states[job] = 'done' if ok else 'failed'
+            self.remaining[job.group] -= 1
+            if not ok:
+                self.failed_groups.add(job.group)
+                self.failed_jobs.append(job)
+            group_done = self.remaining[job.group] == 0
+            failed = job.group in self.failed_groups
+            self.eta.finished(job)
+            print(self.eta.status())
+        # Jobs waiting for this one go ahead, and record themselves if it didn't work out
+        job.finished.set()
+
+        if self.on_job_done is not None:
+            try:
+                self.on_job_done(job, ok, error)
+            except Exception:
+                traceback.print_exc()
+
+        if group_done and self.on_group_done is not None:
+            self.group_pool.submit(self.finish_group, job.group, failed)
+
+    def finish_group(self, group, failed):
+        try:
+            self.on_group_done(group, failed)
+        except Exception:
+            print("ERROR: Finishing {} failed".format(group))
+            traceback.print_exc()
+
+    def cancel(self):
+        """
+        Stop the run: running jobs are stopped and the rest aren't started. run() returns once they've stopped
+        """
+        self.token.cancel()
+
+    def status(self):
+        """
+        Returns {'jobs': {state: number of jobs}, 'total': number of jobs, 'seconds_left': estimate or None}
+        """
+        with self.lock:
+            counts = collections.Counter(self.states.values())
+            seconds_left = self.eta.seconds_left()
+            total = len(self.states)
+        return {'jobs': {state: counts[state] for state in STATES}, 'total': total, 'seconds_left': seconds_left}
+
+    def reserve_space(self, job):
+        if self.disk_space is None:
+            return contextlib.nullcontext()
+        return self.disk_space.reserve(job, job.token)
+
+    def cancelled(self, job, e):
+        """
+        Handle a job that raised cancellation.Cancelled. Returns True if the whole run was cancelled, in which case
+        the job is left as it is for the next run
+        """
+        if self.token.cancelled():
+            job.token.close()
+            job.finished.set()
+            return True
+        print("ERROR: {} {}".format(job.slp_file, e))
+        self.finish(job, False, str(e))
+        return False
+
+    def drop_dumps(self, dumps, run_cancelled):
+        """
+        Release dumps that weren't posted. If the run was cancelled the journal has them for the next run
+        """
+        if run_cancelled and self.journal is not None:
+            return
+        dumps.release()
+
+    def render_worker(self, job):
+        if self.token.cancelled():
+            return
+
+        if self.metrics is not None:
+            job.metrics = self.metrics.start_job(job)
+        # The timer starts once the job gets a slot, so waiting for one can't time the job out
+        job.token = self.token.child()
+
+        if job.dumps is not None:
+            # Rendered by an earlier run, only needs muxing
+            job.token.start_timer(self.job_timeout)
+            self.dumps.put((job, job.dumps))
+            return
+
+        # Wait without taking a slot, so the job being waited for can get one
+        if job.waits_for is not None:
+            while not job.waits_for.wait(1):
+                if self.token.cancelled():
+                    job.token.close()
+                    return
+
+        attempt = 0
+        while True:
+            try:
+                # Wait for disk space before taking a slot, so a waiting game doesn't hold one
+                with self.reserve_space(job), self.slots or contextlib.nullcontext(), \
+                        telemetry.job_context(job.metrics), cancellation.scope(job.token):
+                    job.token.start_timer(self.job_timeout)
+                    job.token.check()
+                    # Retries are part of the same attempt as far as the journal's max_attempts goes
+                    if attempt == 0:
+                        self.record('rendering', job)
+                    with telemetry.phase('render'):
+                        dumps = self.render(job)
+                break
+            except cancellation.Cancelled as e:
+                self.cancelled(job, e)
+                return
+            except self.retry_errors as e:
+                # The backoff isn't part of any attempt's time
+                job.token.stop_timer()
+                if attempt >= self.retries:
+                    print("ERROR: Rendering {} failed {} times, giving up: {}".format(job.slp_file, attempt + 1, e))
+                    self.finish(job, False, str(e))
+                    return
+                backoff = self.retry_backoff * 2 ** attempt
+                attempt += 1
+                print("Warning: Rendering {} failed, trying again in {:g}s: {}".format(job.slp_file, backoff, e))
+                with telemetry.job_context(job.metrics):
+                    telemetry.record('render_retries', attempt)
+                # Wakes up early if the job is cancelled, the next attempt then stops straight away
+                job.token.event.wait(backoff)
+            except Exception as e:
+                print("ERROR: Rendering {} failed".format(job.slp_file))
+                traceback.print_exc()
+                self.finish(job, False, str(e))
+                return
+
+        if dumps is None:
+            self.finish(job, True)
+            return
+        self.record('rendered', job, dumps)
+
+        # Blocks while the post-processing stage is behind, so finished dumps don't pile up on disk
+        self.dumps.put((job, dumps))
+
+    def post_worker(self):
+        while True:
+            item = self.dumps.get()
+            if item is None:
+                return
+            job, dumps = item
+            if self.token.cancelled():
+                job.token.close()
+                self.drop_dumps(dumps, True)
+                continue
+            self.record('muxing', job)
+            # Once post has them, it releases the dumps
+            posted = False
+            try:
+                with telemetry.job_context(job.metrics), cancellation.scope(job.token):
+                    # The job may have timed out while its dumps were waiting
+                    job.token.check()
+                    with telemetry.phase('mux'):
+                        posted = True
+                        self.post(job, dumps)
+            except cancellation.Cancelled as e:
+                run_cancelled = self.cancelled(job, e)
+                if not posted or run_cancelled:
+                    self.drop_dumps(dumps, run_cancelled)
+                continue
+            except Exception as e:
+                print("ERROR: Post-processing {} failed".format(job.slp_file))
+                traceback.print_exc()
+                self.finish(job, False, str(e))
+                if not posted:
+                    dumps.release()
+                continue
+            self.finish(job, True, held=self.keep_rendered)
+
+    def start(self):
+        """
+        Start the workers, so jobs can be submitted
+        """
+        self.post_threads = [threading.Thread(target=self.post_worker) for _ in range(self.num_post)]
+        for t in self.post_threads:
+            t.start()
+        self.render_pool = ThreadPoolExecutor(max_workers=self.num_renderers)
+        self.group_pool = ThreadPoolExecutor(max_workers=self.num_post)
+
+    def submit(self, jobs):
+        """
+        Add jobs to the pipeline, they're rendered in the order given. Can be called again while jobs are running
+        """
+        # Every group's jobs are counted before any can finish, so no group is done early
+        with self.lock:
+            for job in jobs:
+                self.remaining[job.group] = self.remaining.get(job.group, 0) + 1
+                self.eta.add(job)
+        for job in jobs:
+            if job.dumps is None:
+                self.record('queued', job)
+            else:
+                with self.lock:
+                    self.states[job] = 'rendered'
+            self.render_pool.submit(self.render_worker, job)
+
+    def join(self):
+        """
+        Wait for every submitted job to finish, and stop the workers
+        Returns the list of jobs that failed
+        """
+        self.render_pool.shutdown(wait=True)
+
+        # All games are rendered, tell the post-processing workers to stop once the queue is empty
+        for _ in self.post_threads:
+            self.dumps.put(None)
+        for t in self.post_threads:
+            t.join()
+        # Every job is finished, so no more groups can be
+        self.group_pool.shutdown(wait=True)
+        return self.failed_jobs
+
+    def run(self, jobs):
+        """
+        Render and post-process all jobs, returning when every job is finished
+        Returns the list of jobs that failed
+        Raises KeyboardInterrupt if interrupted, once the running jobs have been stopped
+        """
+        jobs = schedule_order(jobs)
+        print("Recording {} games, {}".format(len(jobs), Eta(jobs, self.num_renderers).left()))
+
+        self.start()
+        try:
+            self.submit(jobs)
+            self.render_pool.shutdown(wait=True)
+        except KeyboardInterrupt:
+            print("Cancelling, waiting for running games to stop. Run again to continue where this run stopped")
+            self.cancel()
+            self.join()
+            raise
+        return self.join()
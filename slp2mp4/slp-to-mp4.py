@@ -1,17 +1,38 @@
 #!/usr/bin/env python3
-import os, sys, json, subprocess, time, shutil, uuid, multiprocessing, psutil, glob
+import os, sys, json, subprocess, time, shutil, uuid, glob, contextlib, threading, collections, traceback
 from pathlib import Path
-from slippi import Game
 from config import Config
-from dolphinrunner import DolphinRunner
+import slpscanner
+from dolphinrunner import DolphinRunner, Dumps, RenderTimeout, expected_render_seconds
+from dolphinworker import DolphinWorker, DolphinWorkerPool
+from usertemplate import UserTemplate
+from parallelism import AdaptiveParallelism
+from telemetry import Telemetry
+import telemetry, cancellation
 from ffmpegrunner import FfmpegRunner
+import dumpconcat
+from replayindex import ReplayIndex
+from scheduler import Job, Pipeline, Eta, schedule_order
+from status import StatusReporter
+from journal import Journal, FAILED
+from outputcache import OutputCache
+from diskspace import DiskSpace, estimate_dump_bytes
+from distqueue import DirQueue, Heartbeat, make_worker_id
+from folderwatch import FolderWatch
+import outputcache
+import clips, variants
+from concurrent.futures import ThreadPoolExecutor
 
 VERSION = '1.0.0'
 USAGE = """\
 slp-to-mp4 {}
 Convert slippi files to mp4 videos
 
-USAGE: slp-to-mp4.py REPLAY_FILE [OUT_FILE]
+USAGE: slp-to-mp4.py [--start-frame FRAME] [--end-frame FRAME] REPLAY_FILE [OUT_FILE]
+       slp-to-mp4.py --clips CLIP_MANIFEST [OUT_DIR]
+       slp-to-mp4.py --coordinator QUEUE_DIR REPLAY_FOLDER
+       slp-to-mp4.py --worker QUEUE_DIR
+       slp-to-mp4.py --watch REPLAY_FOLDER
 
 Notes:
 OUT_FILE can be a directory or a file name ending in .mp4, or omitted.
@@ -25,6 +46,17 @@ This will create my_video.mp4 in the current directory:
 This will create videos/my_replay.mp4, creating the videos directory if it doesn't exist
  $ slp-to-mp4.py my_replay.slp videos
 
+--start-frame and --end-frame record only part of the game. Frames are numbered from -123, like in Slippi.
+This will create my_replay_1000-1599.mp4, 10 seconds starting at frame 1000:
+ $ slp-to-mp4.py --start-frame 1000 --end-frame 1599 my_replay.slp
+
+--clips records every clip listed in a clip manifest (see README.md) into OUT_DIR, or the out directory
+
+--coordinator records a folder with the help of --worker processes, on this or other machines, that take games
+from the queue in QUEUE_DIR, a directory they all share (see README.md)
+
+--watch records a folder, then keeps recording each new replay written to it as soon as its game ends, until Ctrl-C
+
 See README.md for details
 """.format(VERSION)
 
@@ -39,6 +71,14 @@ if sys.platform == "win32":
 else:
     THIS_CONFIG = os.path.join(SCRIPT_DIR, 'config.json')
 OUT_DIR = os.path.join(SCRIPT_DIR, 'out')
+INDEX_FILE = os.path.join(SCRIPT_DIR, 'replay_index.db')
+JOURNAL_FILE = os.path.join(SCRIPT_DIR, 'job_journal.db')
+METRICS_DIR = os.path.join(SCRIPT_DIR, 'metrics')
+
+# Distributed runs (--coordinator / --worker)
+LEASE_SECONDS = 60                # a worker that hasn't heartbeated for this long is presumed dead
+HEARTBEAT_SECONDS = 10
+QUEUE_POLL_SECONDS = 1
 
 
 combined_files = []
@@ -48,128 +88,699 @@ def is_game_too_short(num_frames, remove_short):
     return num_frames < MIN_GAME_LENGTH and remove_short
 
 
+# Expected render time of a game in seconds, for scheduling the longest games first and estimating time left
+def job_cost(conf, duration):
+    if is_game_too_short(duration, conf.remove_short):
+        return 0
+    return expected_render_seconds(duration + DURATION_BUFFER, conf.resolution)
+
+
+# Expected size of a game's dumps in bytes, for disk space admission control
+def job_disk_bytes(conf, duration):
+    if is_game_too_short(duration, conf.remove_short):
+        return 0
+    return estimate_dump_bytes((duration + DURATION_BUFFER) / FPS, conf.bitrateKbps)
+
+
+# psutil is imported where it's used, so importing this script (see api.py) doesn't need it
 def get_num_processes(conf):
-    if conf.parallel_games == "recommended":
+    import psutil
+    # "adaptive" starts at the recommended number and changes from there
+    if conf.parallel_games == "recommended" or conf.parallel_games == "adaptive":
         return psutil.cpu_count(logical=False)
     else:
         return int(conf.parallel_games)
 
 
-def clean():
-    for folder in glob.glob("User-*"):
-        shutil.rmtree(folder)
-    for file in glob.glob("slippi-comm-*"):
-        os.remove(file)
-
-# Evaluate whether file should be run. The open in dolphin and combine video and audio with ffmpeg.
-def record_file_slp(slp_file, outfile):
-    conf = Config()
+# Returns AdaptiveParallelism if parallel_games is "adaptive", otherwise None
+def get_adaptive_parallelism(conf):
+    if conf.parallel_games != "adaptive":
+        return None
+    max_games = conf.adaptive_max_games
+    if max_games == "recommended":
+        import psutil
+        max_games = psutil.cpu_count(logical=True)
+    return AdaptiveParallelism(get_num_processes(conf), int(max_games), conf.adaptive_fps_floor)
+
+
+# Where Dolphin's user dirs (with the dumps) go: scratch_dir if it's set, otherwise this script's directory
+def get_scratch_dir(conf):
+    if not conf.scratch_dir:
+        return SCRIPT_DIR
+    # Relative to this script's directory, like the out folder
+    scratch_dir = os.path.join(SCRIPT_DIR, os.path.expanduser(conf.scratch_dir))
+    os.makedirs(scratch_dir, exist_ok=True)
+    return scratch_dir
+
+
+# Remove files left behind by Dolphin jobs that didn't finish, except for the user dirs in keep_user_dirs
+# This script's directory is cleaned too, in case scratch_dir was changed since
+def clean(conf, keep_user_dirs=()):
+    for working_dir in {SCRIPT_DIR, get_scratch_dir(conf)}:
+        for folder in glob.glob(os.path.join(working_dir, "User-*")):
+            if folder not in keep_user_dirs:
+                shutil.rmtree(folder)
+        for file in glob.glob(os.path.join(working_dir, "slippi-comm-*")):
+            os.remove(file)
+
+# Evaluate whether file should be run. Then open in dolphin to dump frames and audio.
+# duration can be passed in if it's already known, e.g. from the replay index
+# If workers (a DolphinWorkerPool) is given, the game is played by one of its persistent Dolphins
+# If template (a UserTemplate) is given, the Dolphin user dir is cloned from it instead of copied and prepared
+# If clip (a clips.Clip with its frames resolved) is given, only the clip is rendered
+# Dolphin's files go in working_dir, the scratch dir by default
+# Returns Dumps, or None if the game wasn't recorded. The dumps must be released by the caller
+def render_slp(conf, slp_file, duration=None, workers=None, template=None, clip=None, working_dir=None):
+    start_frame, end_frame = None, None
+    if clip is not None:
+        # Dolphin stops at the end frame, so there are no extra frames to wait for
+        num_frames = clip.num_frames()
+        start_frame, end_frame = clip.start_frame, clip.end_frame
+    else:
+        # Scan the file to determine number of frames. This only reads the metadata, not every frame
+        if duration is None:
+            duration = slpscanner.scan(slp_file).duration
+        num_frames = duration + DURATION_BUFFER
 
-    # Parse file with py-slippi to determine number of frames
-    slippi_game = Game(slp_file)
-    num_frames = slippi_game.metadata.duration + DURATION_BUFFER
+        if is_game_too_short(duration, conf.remove_short):
+            print("Warning: Game is less than 30 seconds and won't be recorded. Override in config.")
+            return None
 
-    if is_game_too_short(slippi_game.metadata.duration, conf.remove_short):
-        print("Warning: Game is less than 30 seconds and won't be recorded. Override in config.")
-        return
+    if workers is not None:
+        return workers.render(slp_file, num_frames, start_frame, end_frame)
 
     DOLPHIN_USER_DIR = os.path.join(conf.dolphin_dir, 'User')
+    if working_dir is None:
+        working_dir = get_scratch_dir(conf)
     # Dump frames
-    with DolphinRunner(conf, DOLPHIN_USER_DIR, SCRIPT_DIR, uuid.uuid4()) as dolphin_runner:
-        video_file, audio_file = dolphin_runner.run(slp_file, num_frames)
+    with DolphinRunner(conf, DOLPHIN_USER_DIR, working_dir, uuid.uuid4(), template) as dolphin_runner:
+        video_file, audio_file = dolphin_runner.run(slp_file, num_frames, start_frame, end_frame)
+        dolphin_runner.keep_user_dir = True
+        return Dumps(video_file, audio_file, dolphin_runner.user_dir)
+
 
-        # Encode
+# Combine the dumped video and audio with ffmpeg, then remove the dumps
+def mux_slp(conf, dumps, outfile):
+    try:
         ffmpeg_runner = FfmpegRunner(conf.ffmpeg)
-        ffmpeg_runner.run(video_file, audio_file, outfile)
-
-        print('Created {}'.format(outfile))
-
-
-# In the out folder, run through each subdirectory and count the number of mp4 files. Add these files to
-# concat_file.txt. ffmpeg uses this to combine the mp4 files.
-def combine(conf):
-    for subdir, dirs, files in os.walk(OUT_DIR, topdown=False):
-        basedir = os.path.basename(subdir)
-        if os.path.exists(os.path.join(subdir, 'concat_file.txt')):
-            os.remove(os.path.join(subdir, 'concat_file.txt'))
-        file_count = 0
-        with open(os.path.join(subdir, 'concat_file.txt'), 'w+') as concat_file:
-            lines = []
-
-            # Count the number of MP4 files that weren't written using the combine function
-            for file in files:
-                try:
-                    if file.endswith('.mp4') and os.path.join(subdir, file) not in combined_files:
-                        file_count = file_count + 1
-
-                        # Append to lines
-                        lines.append("file \'" + os.path.join(subdir, file) + "\'" + "\n")
-                except Exception:
-                    pass
-
-            # Write lines to the concat_file
-            concat_file.writelines(lines)
-
-        # If there is 1 or more mp4 file and not overwriting an existing file
-        if file_count > 0 and not os.path.exists(os.path.join(OUT_DIR, basedir) + '.mp4'):
-            ffmpeg_runner = FfmpegRunner(conf.ffmpeg)
-            ffmpeg_runner.combine(os.path.join(subdir, 'concat_file.txt'), os.path.join(OUT_DIR, basedir) + '.mp4')
-            combined_files.append(os.path.join(OUT_DIR, basedir) + '.mp4')
-
-            # Remove subdirectory after combined
-            if os.path.exists(os.path.join(OUT_DIR, basedir)) and os.path.exists(os.path.join(OUT_DIR, basedir) + '.mp4'):
-                shutil.rmtree(os.path.join(OUT_DIR, basedir))
-        if os.path.exists(os.path.join(subdir, 'concat_file.txt')):
-            os.remove(os.path.join(subdir, 'concat_file.txt'))
-
-
-# Get a list of the input files and their subdirectories to prepare the output files. Feed this to record_file_slp.
-# If combine is true, combine the files in the out folder every time there is a new subdirectory.
-def record_folder_slp(slp_folder, conf):
-    in_files = []
-    out_files = []
-
-    # Get a list of the input files and their subdirectories. The output file will use the basename of the subdirectory
-    # and the name of the file without the extension
-    for subdir, dirs, files in os.walk(slp_folder):
-        for file in files:
-            if file.endswith('.slp'):
-                in_files.append([subdir, file])
-                out_files.append([os.path.basename(subdir), str(file.split('.')[:-1][0]) + '.mp4'])
-
-    if len(out_files) == 0:
-        RuntimeError("No slp files in folder!")
-    last_dir = out_files[0][0]
-    args = []
-    for index, in_file in enumerate(in_files):
-
-        # Combine last subdirectory on discovery of a new subdirectory
-        if out_files[index][0] != last_dir:
-            if conf.combine:
-                #combine(conf)
-                # TODO: Find a way to fix combining folders while still multiprocessing
-                pass
-            last_dir = out_files[index][0]
-
-        # Make the needed directory in the output
-        if not os.path.isdir(os.path.join(OUT_DIR, out_files[index][0])):
-            os.makedirs(os.path.join(OUT_DIR, out_files[index][0]))
-
-        # Record the single slp file
-        slp_file = os.path.join(in_file[0], in_file[1])
-        out_file = os.path.join(OUT_DIR, out_files[index][0], out_files[index][1])
-        if not os.path.exists(out_file):
-            args.append((slp_file, out_file))
-
-    num_processes = get_num_processes(conf)
-
-    pool = multiprocessing.Pool(processes=num_processes)
-    pool.starmap(record_file_slp, args)
-    pool.close()
-
-    # Combine one last time
-    if conf.combine:
-        combine(conf)
+        ffmpeg_runner.run(dumps.video_file, dumps.audio_file, outfile,
+                          video_start=dumps.video_start, audio_start=dumps.audio_start, duration=dumps.duration,
+                          variants=[(variant.out_file(outfile), variant.height, variant.bitrate_kbps)
+                                    for variant in conf.variants])
+    except cancellation.Cancelled:
+        # If the run was cancelled, keep the dumps, the journal has them for the next run to mux. A game that timed
+        # out is failed, so nothing would ever mux them
+        if not cancellation.run_cancelled():
+            dumps.release()
+        raise
+    except Exception:
+        dumps.release()
+        raise
+    dumps.release()
+
+    telemetry.record('output_bytes', os.path.getsize(outfile))
+    for variant in conf.variants:
+        print('Created {}'.format(variant.out_file(outfile)))
+    print('Created {}'.format(outfile))
+
+
+def record_file_slp(conf, slp_file, outfile, duration=None):
+    dumps = render_slp(conf, slp_file, duration)
+    if dumps is not None:
+        mux_slp(conf, dumps, outfile)
+
+
+# Record clips (a list of clips.Clip). The clips of each replay are played one after another by the same Dolphin,
+# and different replays are recorded in parallel
+def record_clips(conf, clip_list, out_dir):
+    DOLPHIN_USER_DIR = os.path.join(conf.dolphin_dir, 'User')
+
+    def record_replay_clips(slp_file, replay_clips):
+        duration = slpscanner.scan(slp_file).duration
+        for clip in replay_clips:
+            clip.resolve(duration)
+            if clip.out_file is None:
+                clip.out_file = clip.default_out_file(out_dir)
+            os.makedirs(os.path.dirname(clip.out_file), exist_ok=True)
+
+        # A single clip doesn't need Dolphin to stay running afterwards
+        if len(replay_clips) == 1:
+            clip = replay_clips[0]
+            dumps = render_slp(conf, slp_file, template=template, clip=clip)
+            mux_slp(conf, dumps, clip.out_file)
+            return
+
+        # Render every clip before muxing, so Dolphin can be closed as soon as possible
+        worker = DolphinWorker(conf, DOLPHIN_USER_DIR, get_scratch_dir(conf), len(replay_clips), template)
+        rendered = collections.deque()
+        try:
+            try:
+                for clip in replay_clips:
+                    rendered.append((clip, render_slp(conf, slp_file, workers=worker, template=template, clip=clip)))
+            finally:
+                worker.stop()
+            while rendered:
+                clip, dumps = rendered.popleft()
+                mux_slp(conf, dumps, clip.out_file)
+        finally:
+            # mux_slp releases the dumps it's given. If a render or mux failed, release the ones it didn't get to
+            for clip, dumps in rendered:
+                dumps.release()
+
+    failed = []
+    with UserTemplate(conf, DOLPHIN_USER_DIR, get_scratch_dir(conf)) as template, \
+            ThreadPoolExecutor(max_workers=get_num_processes(conf)) as pool:
+        futures = {pool.submit(record_replay_clips, slp_file, replay_clips): slp_file
+                   for slp_file, replay_clips in clips.by_replay(clip_list).items()}
+        for future, slp_file in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                print("ERROR: Recording clips of {} failed: {}".format(slp_file, e))
+                failed.append(slp_file)
+
+    for slp_file in failed:
+        print("Warning: Failed to record clips of {}".format(slp_file))
+
+
+# Returns an OutputCache if output_cache_dir is set, otherwise None
+def get_output_cache(conf):
+    if not conf.output_cache_dir:
+        return None
+    # Relative to this script's directory, like the out folder
+    cache_dir = os.path.join(SCRIPT_DIR, os.path.expanduser(conf.output_cache_dir))
+    max_bytes = int(conf.output_cache_max_gb * 1024 * 1024 * 1024)
+    return OutputCache(cache_dir, max_bytes, outputcache.fingerprint(conf))
+
+
+# Put the cached video for key at out_file, and its variants next to it
+# Returns False if any of them isn't cached
+def get_cached(conf, cache, key, out_file):
+    for variant in conf.variants:
+        if not cache.get(variant.cache_key(key), variant.out_file(out_file)):
+            return False
+    # Last, the main video existing means the game is done
+    return cache.get(key, out_file)
+
+
+# Add a recorded video and its variants to the cache
+def put_cached(conf, cache, key, out_file):
+    try:
+        for variant in conf.variants:
+            cache.put(variant.cache_key(key), variant.out_file(out_file))
+        cache.put(key, out_file)
+    except OSError as e:
+        print("Warning: Couldn't add {} to the cache: {}".format(out_file, e))
+
+
+# Returns a StatusReporter for pipeline with the status_* settings
+def get_status_reporter(conf, pipeline):
+    status_file = None
+    if conf.status_file:
+        # Relative to this script's directory, like the out folder
+        status_file = os.path.join(SCRIPT_DIR, os.path.expanduser(conf.status_file))
+    return StatusReporter(pipeline, status_file, conf.status_port or None, conf.status_print_seconds or None)
+
+
+def get_combined_file(subdir):
+    return os.path.join(OUT_DIR, os.path.basename(subdir)) + '.mp4'
+
+
+# Combine the mp4 files in one subdirectory of the out folder into <subdirectory name>.mp4 in the out folder, then
+# remove the subdirectory. Each variant's files are combined the same way, into <subdirectory name>.<variant>.mp4
+# Returns the combined file, or None if there was nothing to combine
+def combine_dir(conf, subdir):
+    combined_file = get_combined_file(subdir)
+
+    # Don't overwrite an existing file
+    if not os.path.isdir(subdir) or os.path.exists(combined_file):
+        return None
+
+    # Find the MP4 files that weren't written using the combine function
+    files = [os.path.join(subdir, file) for file in sorted(os.listdir(subdir)) if file.endswith('.mp4')]
+    main_files, variant_files = variants.split_out_files([path for path in files if path not in combined_files],
+                                                         conf.variants)
+
+    # If there is 1 or more mp4 file
+    if len(main_files) == 0:
+        return None
+
+    # The main file last, the main file existing means the subdirectory is done
+    for variant in conf.variants:
+        if variant_files[variant.name]:
+            concat_files(conf, subdir, variant_files[variant.name], variant.out_file(combined_file))
+    concat_files(conf, subdir, main_files, combined_file)
+
+    # Remove subdirectory after combined
+    if os.path.exists(combined_file):
+        shutil.rmtree(subdir)
+    return combined_file
+
+
+# Combine files (in a subdirectory of the out folder) into combined_file. The files are added to concat_file.txt
+# in the order given. ffmpeg uses this to combine them.
+def concat_files(conf, subdir, files, combined_file):
+    concat_file_path = os.path.join(subdir, 'concat_file.txt')
+    with open(concat_file_path, 'w+') as concat_file:
+        concat_file.writelines("file \'" + path + "\'" + "\n" for path in files)
+
+    ffmpeg_runner = FfmpegRunner(conf.ffmpeg)
+    ffmpeg_runner.combine(concat_file_path, combined_file)
+    combined_files.append(combined_file)
+    os.remove(concat_file_path)
+
+
+# Combine the dumps of every game in a subdirectory of the out folder, held as [(job, dumps)], straight into
+# <subdirectory name>.mp4 in the out folder with one ffmpeg run, then remove the dumps and the subdirectory.
+# If some games failed, some were muxed to their own mp4 by an earlier run, or the combine fails, each game is
+# muxed to its own mp4 instead and those are combined as usual.
+# Returns the combined file, or None if nothing was combined
+def combine_held_dumps(conf, subdir, held, failed, journal):
+    held.sort(key=lambda game: game[0].out_file)
+    combined_file = get_combined_file(subdir)
+    muxed_earlier = any(file.endswith('.mp4') for file in os.listdir(subdir))
+
+    if not failed and not muxed_earlier and not os.path.exists(combined_file):
+        try:
+            dumpconcat.combine_dumps(FfmpegRunner(conf.ffmpeg), [dumps for _, dumps in held], combined_file, subdir)
+        except (RuntimeError, OSError) as e:
+            print("Warning: Combining {} from the dumps failed, muxing each game instead ({})".format(subdir, e))
+        else:
+            for job, dumps in held:
+                dumps.release()
+                journal.done(job)
+            combined_files.append(combined_file)
+            shutil.rmtree(subdir)
+            print('Created {}'.format(combined_file))
+            return combined_file
+
+    for job, dumps in held:
+        mux_slp(conf, dumps, job.out_file)
+        journal.done(job)
+    if failed:
+        print("Warning: Not combining {} because some games failed to record".format(subdir))
+        return None
+    return combine_dir(conf, subdir)
+
+
+# Get a list of the input files and their subdirectories to prepare the output files. Feed these through the
+# render/post-processing pipeline. If combine is true, each subdirectory is combined as soon as all of its games are done.
+# Progress is recorded in the job journal, so if the run is interrupted the next run only does the unfinished jobs.
+# With watch, the folder is watched for new replays once the games in it are started, see watch_folder_jobs
+def record_folder_slp(slp_folder, conf, watch=False):
+    metrics_file = os.path.join(METRICS_DIR, time.strftime('%Y%m%dT%H%M%S') + '.jsonl')
+    with Journal(JOURNAL_FILE) as journal, Telemetry(metrics_file, FPS) as metrics, \
+            get_output_cache(conf) or contextlib.nullcontext() as cache:
+        # Keep the dumps of games that were rendered but not muxed, they can be muxed without rendering again
+        clean(conf, journal.unfinished_user_dirs())
+        if not watch:
+            record_folder_jobs(slp_folder, conf, journal, metrics, cache)
+            return
+        # Watching starts before the folder is scanned, so no replay is missed in between
+        with FolderWatch(slp_folder, conf.watch_stable_seconds) as folder_watch:
+            record_folder_jobs(slp_folder, conf, journal, metrics, cache, folder_watch)
+
+
+# Find the games in slp_folder that still need recording, as [Job], and the output subdirectories of all games
+# cache, if given, is an OutputCache that videos are taken from instead of rendering
+# is_ready, if given, is called with each replay's path and replays it returns False for are left out
+def find_folder_jobs(slp_folder, conf, journal, metrics, cache=None, is_ready=None):
+    # Find the replays in the folder. The index remembers replays from previous runs, so only new or changed
+    # files get scanned
+    scan_start = time.perf_counter()
+    with ReplayIndex(INDEX_FILE, MIN_GAME_LENGTH) as index:
+        replays = index.scan_folder(slp_folder)
+    metrics.write({'type': 'index', 'replays': len(replays), 'scan_seconds': time.perf_counter() - scan_start})
+    if is_ready is not None:
+        replays = [replay for replay in replays if is_ready(replay.path)]
+
+    jobs = []
+    groups = set()
+    for replay in replays:
+        job, group = make_folder_job(conf, replay, journal, cache)
+        if group is not None:
+            groups.add(group)
+        if job is not None:
+            jobs.append(job)
+
+    if len(groups) == 0 and is_ready is None:
+        print("No slp files to record in folder!")
+    return jobs, groups
+
+
+# Make the Job for a replay (an IndexEntry) of a folder. The output file uses the basename of the replay's
+# subdirectory and the name of the file without the extension
+# Returns the job, or None if the game doesn't need recording, and the game's output subdirectory, or None if the
+# replay is skipped
+def make_folder_job(conf, replay, journal, cache=None):
+    subdir, file = os.path.split(replay.path)
+    if replay.error is not None:
+        print("Warning: Skipping {}: {}".format(replay.path, replay.error))
+        return None, None
+    if replay.should_skip(conf.remove_short):
+        return None, None
+
+    # Make the needed directory in the output
+    out_dir = os.path.join(OUT_DIR, os.path.basename(subdir))
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Record the single slp file
+    slp_file = replay.path
+    out_file = os.path.join(out_dir, str(file.split('.')[:-1][0]) + '.mp4')
+
+    # Outputs are only created once complete, so if it exists it's done
+    if os.path.exists(out_file):
+        return None, out_dir
+    if conf.combine and os.path.exists(get_combined_file(out_dir)):
+        return None, out_dir
+
+    job = Job(slp_file, out_file, replay.duration)
+    job.parse_seconds = replay.scan_seconds
+    job.cost = job_cost(conf, job.duration)
+    job.disk_bytes = job_disk_bytes(conf, job.duration)
+    entry = journal.get(out_file)
+    if entry is not None:
+        if entry.state == FAILED and entry.attempts >= conf.max_attempts:
+            print("Warning: Skipping {}, it failed {} times. Last error: {}".format(slp_file, entry.attempts, entry.error))
+            return None, out_dir
+        job.dumps = entry.dumps()
+
+    # The same replay may have been recorded before, maybe from another folder
+    if cache is not None:
+        job.cache_key = cache.key(replay.sha1)
+        if job.dumps is None and get_cached(conf, cache, job.cache_key, out_file):
+            print('Created {} from the cache'.format(out_file))
+            return None, out_dir
+    return job, out_dir
+
+
+# Combine a subdirectory of the out folder once all of its games are done, if combine is on
+def finish_group(conf, group, failed, metrics):
+    if not conf.combine:
+        return
+    if failed:
+        print("Warning: Not combining {} because some games failed to record".format(group))
+        return
+    combine_start = time.perf_counter()
+    combined_file = combine_dir(conf, group)
+    if combined_file is not None:
+        metrics.record_combine(group, time.perf_counter() - combine_start, combined_file)
+
+
+# cache, if given, is an OutputCache that videos are taken from instead of rendering, and added to once recorded
+# folder_watch, if given, is a FolderWatch of slp_folder. Replays that aren't complete yet are left to it
+def record_folder_jobs(slp_folder, conf, journal, metrics, cache=None, folder_watch=None):
+    jobs, groups = find_folder_jobs(slp_folder, conf, journal, metrics, cache,
+                                    folder_watch.ready if folder_watch is not None else None)
+    if not groups and folder_watch is None:
+        return
+
+    # If the same replay is in the folder more than once, only the first copy is rendered. The others wait for it
+    # to finish, then take its video from the cache, or record themselves if it failed or made no video of its own.
+    # The pipeline starts them last so the first copy is likely done by then
+    first_jobs = {}
+
+    def find_duplicates(jobs):
+        for job in jobs:
+            if job.cache_key is not None and first_jobs.setdefault(job.cache_key, job) is not job:
+                job.waits_for = first_jobs[job.cache_key].finished
+
+    find_duplicates(jobs)
+
+    def render(job):
+        if job.waits_for is not None and get_cached(conf, cache, job.cache_key, job.out_file):
+            telemetry.record('cache_hit', True)
+            print('Created {} from the cache'.format(job.out_file))
+            return None
+        return render_slp(conf, job.slp_file, job.duration, workers, template)
+
+    def mux(job, dumps):
+        mux_slp(conf, dumps, job.out_file)
+        if job.cache_key is not None:
+            put_cached(conf, cache, job.cache_key, job.out_file)
+
+    # A watched folder can always get more games, so there's no knowing when a subdirectory is finished
+    combine = conf.combine and folder_watch is None
+    if conf.combine and not combine:
+        print("Warning: Games aren't combined while watching a folder, run again without --watch to combine them")
+
+    # With single pass combine, games aren't muxed on their own. Their dumps are held until every game in the
+    # subdirectory is rendered, then muxed and combined in one go
+    single_pass = combine and conf.single_pass_combine
+    if single_pass and conf.variants:
+        # The variants are encoded while muxing each game
+        print("Warning: single_pass_combine is off while there are variants")
+        single_pass = False
+    held_dumps = {}
+    held_lock = threading.Lock()
+
+    def hold_dumps(job, dumps):
+        with held_lock:
+            held_dumps.setdefault(job.group, []).append((job, dumps))
+
+    def on_group_done(group, failed):
+        with held_lock:
+            held = held_dumps.pop(group, [])
+        if not held:
+            finish_group(conf, group, failed, metrics)
+            return
+        combine_start = time.perf_counter()
+        combined_file = combine_held_dumps(conf, group, held, failed, journal)
+        if combined_file is not None:
+            metrics.record_combine(group, time.perf_counter() - combine_start, combined_file)
+
+    # Subdirectories where every game was recorded in a previous run can be combined straight away
+    if combine:
+        for group in groups - set(job.group for job in jobs):
+            on_group_done(group, False)
+
+    # Dolphin settings are the same for every game, so they're applied once to a template user dir that each
+    # game's user dir is cloned from
+    DOLPHIN_USER_DIR = os.path.join(conf.dolphin_dir, 'User')
+    scratch_dir = get_scratch_dir(conf)
+    with UserTemplate(conf, DOLPHIN_USER_DIR, scratch_dir) as template:
+
+        # Persistent Dolphins play many games each instead of starting a new Dolphin for every game
+        workers = None
+        if conf.persistent_dolphin:
+            workers = DolphinWorkerPool(conf, DOLPHIN_USER_DIR, scratch_dir, conf.persistent_dolphin_games, template)
+
+        # With adaptive parallelism there is a render thread for the most games we'd run, and the number that
+        # actually render at once is changed while running
+        adaptive = get_adaptive_parallelism(conf)
+        num_processes = get_num_processes(conf) if adaptive is None else adaptive.max_games
+        pipeline = Pipeline(
+            render=render,
+            post=hold_dumps if single_pass else mux,
+            num_renderers=num_processes,
+            num_post=conf.parallel_encodes,
+            # Allow one finished game per Dolphin to wait for muxing before Dolphins have to wait
+            queue_size=num_processes,
+            on_group_done=on_group_done if combine else None,
+            journal=journal,
+            slots=adaptive.slots if adaptive is not None else None,
+            metrics=metrics,
+            keep_rendered=single_pass,
+            job_timeout=conf.job_timeout_minutes * 60 or None,
+            retries=conf.render_retries,
+            retry_backoff=conf.retry_backoff_seconds,
+            retry_errors=(RenderTimeout,),
+            disk_space=DiskSpace(scratch_dir, int(conf.scratch_min_free_gb * 1024 * 1024 * 1024)))
+        with workers or contextlib.nullcontext(), adaptive or contextlib.nullcontext(), \
+                get_status_reporter(conf, pipeline):
+            if folder_watch is None:
+                failed_jobs = pipeline.run(jobs)
+            else:
+                failed_jobs = watch_folder_jobs(conf, pipeline, folder_watch, jobs, journal, cache, find_duplicates)
+
+    for job in failed_jobs:
+        print("Warning: Failed to record {}".format(job.slp_file))
+
+
+# Record the games found when the watch started (jobs), then each new replay in the watched folder as soon as it's
+# complete, until Ctrl-C. find_duplicates(jobs) links new games to earlier copies of the same replay
+# Returns the list of jobs that failed
+def watch_folder_jobs(conf, pipeline, folder_watch, jobs, journal, cache, find_duplicates):
+    pipeline.start()
+    try:
+        print("Recording {} games, then watching {} for new replays. Press Ctrl-C to stop".format(
+            len(jobs), folder_watch.folder))
+        pipeline.submit(schedule_order(jobs))
+        with ReplayIndex(INDEX_FILE, MIN_GAME_LENGTH) as index:
+            while True:
+                for path in folder_watch.wait():
+                    try:
+                        replay = index.scan_file(path)
+                    except OSError as e:
+                        print("Warning: Skipping {}: {}".format(path, e))
+                        continue
+                    job, _ = make_folder_job(conf, replay, journal, cache)
+                    if job is None:
+                        continue
+                    print("Queued {}".format(path))
+                    find_duplicates([job])
+                    pipeline.submit([job])
+    except KeyboardInterrupt:
+        print("Cancelling, waiting for running games to stop. Run again to continue where this run stopped")
+        pipeline.cancel()
+        pipeline.join()
+        raise
+
+
+# Record a folder with workers on other machines (see run_worker). The games are published to the shared queue in
+# queue_dir, games of workers that stop responding are put back in the queue, and each subdirectory is combined
+# here once all of its games are done.
+# Paths are given to the workers as they are, so the replays and the out folder must be at the same path everywhere
+def coordinate_folder(slp_folder, conf, queue_dir):
+    metrics_file = os.path.join(METRICS_DIR, time.strftime('%Y%m%dT%H%M%S') + '.jsonl')
+    with Journal(JOURNAL_FILE) as journal, Telemetry(metrics_file, FPS) as metrics, \
+            get_output_cache(conf) or contextlib.nullcontext() as cache, DirQueue(queue_dir) as queue:
+        queue.reset()
+        jobs, groups = find_folder_jobs(slp_folder, conf, journal, metrics, cache)
+        for group in groups - set(job.group for job in jobs):
+            finish_group(conf, group, False, metrics)
+
+        pending = {}
+        remaining = collections.Counter(job.group for job in jobs)
+        failed_groups = set()
+        # Workers claim jobs in id order, so the rank makes them take the longest games first
+        jobs.sort(key=lambda job: -job.cost)
+        eta = Eta(jobs)
+        for rank, job in enumerate(jobs):
+            # Dumps from an earlier local run can't be muxed by a worker, it records the game again
+            if job.dumps is not None:
+                job.dumps.release()
+            job_id = '{:06d}-{}'.format(rank, uuid.uuid4().hex)
+            pending[job_id] = job
+            job.metrics = metrics.start_job(job)
+            queue.publish({'id': job_id, 'slp_file': job.slp_file, 'out_file': job.out_file, 'duration': job.duration})
+            journal.queued(job)
+        print("Published {} games to {}".format(len(jobs), queue_dir))
+
+        while pending:
+            time.sleep(QUEUE_POLL_SECONDS)
+            new_leases, expired = queue.check_leases(LEASE_SECONDS, conf.max_attempts)
+            for job_id, worker_id in new_leases:
+                if job_id in pending:
+                    journal.rendering(pending[job_id])
+                    print("{} is recording {}".format(worker_id, pending[job_id].slp_file))
+            for result in expired:
+                print("Warning: Worker stopped responding while recording {}".format(result['slp_file']))
+
+            for result in queue.collect():
+                job = pending.pop(result['id'], None)
+                if job is None:
+                    continue
+                ok = result['ok']
+                if ok:
+                    journal.done(job)
+                    if job.cache_key is not None:
+                        put_cached(conf, cache, job.cache_key, job.out_file)
+                else:
+                    journal.failed(job, result.get('error'))
+                    failed_groups.add(job.group)
+                    print("Warning: Failed to record {}: {}".format(job.slp_file, result.get('error')))
+                job.metrics.update(result.get('metrics') or {})
+                metrics.finish_job(job.metrics, ok, result.get('error'))
+                eta.finished(job)
+                print(eta.status())
+
+                remaining[job.group] -= 1
+                if remaining[job.group] == 0:
+                    finish_group(conf, job.group, job.group in failed_groups, metrics)
+
+        queue.close()
+
+
+# Record one game from the shared queue, keeping its lease alive while it's recorded
+def record_leased_job(conf, lease, worker_id, workers, template, working_dir, disk_space):
+    job = lease.job
+    # For disk_space, which admits Jobs
+    space_job = Job(job['slp_file'], job['out_file'], job['duration'])
+    space_job.disk_bytes = job_disk_bytes(conf, job['duration'])
+    job_metrics = {}
+    ok, error = True, None
+    with Heartbeat(lease, HEARTBEAT_SECONDS), telemetry.job_context(job_metrics):
+        try:
+            with disk_space.reserve(space_job), telemetry.phase('render'):
+                dumps = render_slp(conf, job['slp_file'], job['duration'], workers, template, working_dir=working_dir)
+            if dumps is not None:
+                os.makedirs(os.path.dirname(job['out_file']), exist_ok=True)
+                with telemetry.phase('mux'):
+                    mux_slp(conf, dumps, job['out_file'])
+        except Exception as e:
+            print("ERROR: Recording {} failed".format(job['slp_file']))
+            traceback.print_exc()
+            ok, error = False, str(e)
+        finally:
+            disk_space.release(space_job)
+
+    if not lease.finish(ok, {'error': error, 'metrics': job_metrics, 'worker': worker_id}):
+        print("Warning: {} was taken back by the coordinator before it finished".format(job['slp_file']))
+
+
+# Remove the working dirs of workers on this machine that are no longer running
+def clean_worker_dirs(conf):
+    import psutil
+    for folder in glob.glob(os.path.join(get_scratch_dir(conf), "worker-*")):
+        pid = os.path.basename(folder).split('-')[1]
+        if not pid.isdigit() or not psutil.pid_exists(int(pid)):
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+# Record games from the shared queue in queue_dir (see coordinate_folder) until the coordinator says it's done.
+# Runs parallel_games games at a time, each with its own lease. Each worker has its own working dir, so several
+# can run on the same machine
+def run_worker(conf, queue_dir):
+    clean_worker_dirs(conf)
+    working_dir = os.path.join(get_scratch_dir(conf), 'worker-{}-{}'.format(os.getpid(), uuid.uuid4().hex[:8]))
+    os.makedirs(working_dir)
+    DOLPHIN_USER_DIR = os.path.join(conf.dolphin_dir, 'User')
+    disk_space = DiskSpace(working_dir, int(conf.scratch_min_free_gb * 1024 * 1024 * 1024))
+
+    def work(queue):
+        worker_id = make_worker_id()
+        while True:
+            lease = queue.claim(worker_id)
+            if lease is not None:
+                record_leased_job(conf, lease, worker_id, workers, template, working_dir, disk_space)
+            elif queue.is_closed():
+                return
+            else:
+                time.sleep(QUEUE_POLL_SECONDS)
+
+    try:
+        with DirQueue(queue_dir) as queue, UserTemplate(conf, DOLPHIN_USER_DIR, working_dir) as template:
+            workers = None
+            if conf.persistent_dolphin:
+                workers = DolphinWorkerPool(conf, DOLPHIN_USER_DIR, working_dir, conf.persistent_dolphin_games, template)
+            with workers or contextlib.nullcontext():
+                threads = [threading.Thread(target=work, args=(queue,)) for _ in range(get_num_processes(conf))]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+    finally:
+        shutil.rmtree(working_dir, ignore_errors=True)
+
+
+# Remove "name VALUE" from args and return VALUE converted with convert, or None if the option isn't there
+def pop_option(args, name, convert=str):
+    if name not in args:
+        return None
+    i = args.index(name)
+    if i + 1 >= len(args):
+        print("{} needs a value\n".format(name))
+        print(USAGE)
+        sys.exit(1)
+    value = args[i + 1]
+    del args[i:i + 2]
+    try:
+        return convert(value)
+    except ValueError:
+        print("Invalid value for {}: {}\n".format(name, value))
+        print(USAGE)
+        sys.exit(1)
 
 
 def main():
@@ -180,19 +791,51 @@ def main():
         print(USAGE)
         sys.exit()
 
-    slp_file = os.path.abspath(sys.argv[1])
-    clean()
+    args = sys.argv[1:]
+    start_frame = pop_option(args, '--start-frame', int)
+    end_frame = pop_option(args, '--end-frame', int)
+    clip_manifest = pop_option(args, '--clips')
+    coordinator_queue = pop_option(args, '--coordinator')
+    worker_queue = pop_option(args, '--worker')
+    watch_folder = pop_option(args, '--watch')
     os.makedirs(OUT_DIR, exist_ok=True)
 
+    if worker_queue is not None:
+        run_worker(Config(), os.path.abspath(worker_queue))
+        return
+
+    if coordinator_queue is not None:
+        if not args:
+            print(USAGE)
+            sys.exit(1)
+        coordinate_folder(os.path.abspath(args[0]), Config(), os.path.abspath(coordinator_queue))
+        return
+
+    if watch_folder is not None:
+        record_folder_slp(os.path.abspath(watch_folder), Config(), watch=True)
+        return
+
+    if clip_manifest is not None:
+        outdir = os.path.abspath(args[0]) if args else OUT_DIR
+        conf = Config()
+        clean(conf)
+        record_clips(conf, clips.load_manifest(clip_manifest, outdir), outdir)
+        return
+
+    if not args:
+        print(USAGE)
+        sys.exit(1)
+    slp_file = os.path.abspath(args[0])
+
     # Handle all the outfile argument possibilities
     outfile = ''
-    if len(sys.argv) > 2:
+    if len(args) > 1:
         outfile_name = ''
         outdir = ''
-        if sys.argv[2].endswith('.mp4'):
-            outdir, outfile_name = os.path.split(sys.argv[2])
+        if args[1].endswith('.mp4'):
+            outdir, outfile_name = os.path.split(args[1])
         else:
-            outdir = sys.argv[2]
+            outdir = args[1]
             outfile_name, _ = os.path.splitext(os.path.basename(slp_file))
             outfile_name += '.mp4'
 
@@ -205,12 +848,24 @@ def main():
         outfile += '.mp4'
         outfile = os.path.join(OUT_DIR, outfile)
 
-    if os.path.isdir(slp_file):
+    if start_frame is not None or end_frame is not None:
+        # Unless an mp4 file name was given, the clip is named after its frames
+        clip_file = outfile if len(args) > 1 and args[1].endswith('.mp4') else None
+        conf = Config()
+        clean(conf)
+        record_clips(conf, [clips.Clip(slp_file, start_frame, end_frame, clip_file)], os.path.dirname(outfile))
+    elif os.path.isdir(slp_file):
         conf = Config()
         record_folder_slp(slp_file, conf)
     else:
-        record_file_slp(slp_file, outfile)
+        conf = Config()
+        clean(conf)
+        record_file_slp(conf, slp_file, outfile)
 
 
 if __name__ == '__main__':
-    main()
+    try:
+        main()
+    except KeyboardInterrupt:
+        print("Cancelled")
+        sys.exit(130)
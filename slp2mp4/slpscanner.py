@@ -0,0 +1,273 @@
+import struct
+
+# Lightweight replacement for slippi.Game() when all we need is the game length, players and stage.
+# Game() decodes every frame event in the replay; this only reads the UBJSON header, the event
+# payload sizes + game start events at the beginning of the raw block, and the metadata block after it.
+# See https://github.com/project-slippi/slippi-wiki/blob/master/SPEC.md
+
+FIRST_FRAME_INDEX = -123
+
+EVENT_PAYLOADS = 0x35
+GAME_START = 0x36
+PRE_FRAME_UPDATE = 0x37
+
+# Offsets inside the game start event, counted from the command byte
+STAGE_OFFSET = 0x13
+PLAYER_CHARACTER_OFFSET = 0x65
+PLAYER_TYPE_OFFSET = 0x66
+PLAYER_BLOCK_SIZE = 0x24
+PLAYER_TYPE_EMPTY = 3
+NUM_PORTS = 4
+
+# Enough to hold the event payload sizes and a game start event in every known replay version
+HEADER_READ_SIZE = 4096
+
+RAW_PREFIX = b'{U\x03raw[$U#l'
+METADATA_PREFIX = b'U\x08metadata'
+
+
+class Player:
+    def __init__(self, port, character, player_type, netplay_name=None, code=None):
+        self.port = port                # 0-indexed
+        self.character = character      # external character id
+        self.type = player_type         # 0 = human, 1 = cpu, 2 = demo
+        self.netplay_name = netplay_name
+        self.code = code
+
+    def to_dict(self):
+        return {
+            'port': self.port,
+            'character': self.character,
+            'type': self.type,
+            'netplay_name': self.netplay_name,
+            'code': self.code
+        }
+
+
+class ReplayInfo:
+    def __init__(self, duration, players, stage, from_metadata):
+        self.duration = duration            # number of frames, same as slippi.Game().metadata.duration
+        self.players = players              # list of Player
+        self.stage = stage                  # stage id, None if the game start event couldn't be read
+        self.from_metadata = from_metadata  # False if the duration was found by counting frame events
+
+
+class UbjsonReader:
+    """
+    Minimal UBJSON decoder - enough for the metadata block Slippi writes
+    """
+    INT_FORMATS = {b'i': '>b', b'U': '>B', b'I': '>h', b'l': '>i', b'L': '>q', b'd': '>f', b'D': '>d'}
+
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.pos = pos
+
+    def read(self, n):
+        if self.pos + n > len(self.data):
+            raise ValueError("Unexpected end of UBJSON data")
+        b = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return b
+
+    def read_marker(self):
+        marker = self.read(1)
+        # No-op markers can appear anywhere
+        while marker == b'N':
+            marker = self.read(1)
+        return marker
+
+    def read_length(self):
+        return self.read_value(self.read_marker())
+
+    def read_value(self, marker):
+        if marker in self.INT_FORMATS:
+            fmt = self.INT_FORMATS[marker]
+            return struct.unpack(fmt, self.read(struct.calcsize(fmt)))[0]
+        if marker == b'S' or marker == b'H':
+            return self.read(self.read_length()).decode('utf-8', errors='replace')
+        if marker == b'C':
+            return self.read(1).decode('utf-8', errors='replace')
+        if marker == b'T':
+            return True
+        if marker == b'F':
+            return False
+        if marker == b'Z':
+            return None
+        if marker == b'{':
+            return self.read_object()
+        if marker == b'[':
+            return self.read_array()
+        raise ValueError("Unknown UBJSON marker {!r}".format(marker))
+
+    def read_container_header(self):
+        # Optimized containers may specify a single type and/or count up front
+        value_type = None
+        count = None
+        if self.data[self.pos:self.pos + 1] == b'$':
+            self.pos += 1
+            value_type = self.read(1)
+        if self.data[self.pos:self.pos + 1] == b'#':
+            self.pos += 1
+            count = self.read_length()
+        return value_type, count
+
+    def read_object(self):
+        value_type, count = self.read_container_header()
+        obj = {}
+        while count is None or len(obj) < count:
+            if count is None and self.data[self.pos:self.pos + 1] == b'}':
+                self.pos += 1
+                break
+            key = self.read(self.read_length()).decode('utf-8', errors='replace')
+            obj[key] = self.read_value(value_type or self.read_marker())
+        return obj
+
+    def read_array(self):
+        value_type, count = self.read_container_header()
+        arr = []
+        while count is None or len(arr) < count:
+            if count is None and self.data[self.pos:self.pos + 1] == b']':
+                self.pos += 1
+                break
+            arr.append(self.read_value(value_type or self.read_marker()))
+        return arr
+
+
+def read_metadata(f, metadata_pos):
+    """
+    Parse the UBJSON metadata block that follows the raw event data
+    Returns a dict, or None if the replay has no (complete) metadata
+    """
+    f.seek(metadata_pos)
+    data = f.read()
+    if not data.startswith(METADATA_PREFIX):
+        return None
+    reader = UbjsonReader(data, len(METADATA_PREFIX))
+    try:
+        if reader.read_marker() != b'{':
+            return None
+        return reader.read_object()
+    except ValueError:
+        return None
+
+
+def parse_event_payloads(data):
+    """
+    Returns {command_byte: payload_size}, and the offset of the first event after the payloads event
+    """
+    if len(data) < 2 or data[0] != EVENT_PAYLOADS:
+        raise RuntimeError("Replay does not start with an event payloads event")
+    size = data[1]
+    sizes = {EVENT_PAYLOADS: size}
+    for i in range(2, size, 3):
+        command, payload_size = struct.unpack('>BH', data[i:i + 3])
+        sizes[command] = payload_size
+    return sizes, 1 + size
+
+
+def parse_game_start(data):
+    """
+    Returns stage, [Player] from a game start event (data begins at the command byte)
+    """
+    stage = None
+    if len(data) >= STAGE_OFFSET + 2:
+        stage = struct.unpack('>H', data[STAGE_OFFSET:STAGE_OFFSET + 2])[0]
+
+    players = []
+    for port in range(NUM_PORTS):
+        char_offset = PLAYER_CHARACTER_OFFSET + PLAYER_BLOCK_SIZE * port
+        type_offset = PLAYER_TYPE_OFFSET + PLAYER_BLOCK_SIZE * port
+        if len(data) <= type_offset:
+            break
+        player_type = data[type_offset]
+        if player_type != PLAYER_TYPE_EMPTY:
+            players.append(Player(port, data[char_offset], player_type))
+    return stage, players
+
+
+def count_frames(f, raw_pos, raw_length, payload_sizes):
+    """
+    Fallback for replays without metadata (e.g. dolphin crashed, or the game is still in progress):
+    walk the raw events and find the last frame number from the pre-frame update events
+    Returns number of frames, or None if there are no frame events
+    """
+    f.seek(raw_pos)
+    data = f.read(raw_length) if raw_length else f.read()
+    pos = 0
+    last_frame = None
+    end = len(data)
+    while pos < end:
+        command = data[pos]
+        # Unknown command means the data is truncated or corrupt - stop at the last good frame
+        if command not in payload_sizes:
+            break
+        event_end = pos + 1 + payload_sizes[command]
+        if event_end > end:
+            break
+        if command == PRE_FRAME_UPDATE:
+            last_frame = struct.unpack_from('>i', data, pos + 1)[0]
+        pos = event_end
+    if last_frame is None:
+        return None
+    return last_frame - FIRST_FRAME_INDEX + 1
+
+
+def apply_metadata_players(players, metadata):
+    metadata_players = metadata.get('players', {})
+    for player in players:
+        names = metadata_players.get(str(player.port), {}).get('names', {})
+        player.netplay_name = names.get('netplay')
+        player.code = names.get('code')
+
+
+def is_complete(slp_file):
+    """
+    True if Slippi has finished writing the replay: the raw data length is filled in and the metadata block
+    follows it. While a game is being played (or if Dolphin died during it) neither is there yet
+    """
+    with open(slp_file, 'rb') as f:
+        header = f.read(len(RAW_PREFIX) + 4)
+        if len(header) < len(RAW_PREFIX) + 4 or not header.startswith(RAW_PREFIX):
+            return False
+        raw_length = struct.unpack('>I', header[len(RAW_PREFIX):])[0]
+        if not raw_length:
+            return False
+        return read_metadata(f, len(header) + raw_length) is not None
+
+
+def scan(slp_file):
+    """
+    Read the duration, players and stage of a replay without decoding every frame
+    Returns a ReplayInfo
+    """
+    with open(slp_file, 'rb') as f:
+        header = f.read(len(RAW_PREFIX) + 4 + HEADER_READ_SIZE)
+        if not header.startswith(RAW_PREFIX):
+            raise RuntimeError("{} is not a slippi replay".format(slp_file))
+        raw_pos = len(RAW_PREFIX) + 4
+        # Raw length is 0 when dolphin didn't finish writing the file
+        raw_length = struct.unpack('>I', header[len(RAW_PREFIX):raw_pos])[0]
+
+        raw_start = header[raw_pos:]
+        payload_sizes, game_start_pos = parse_event_payloads(raw_start)
+        stage = None
+        players = []
+        if raw_start[game_start_pos:game_start_pos + 1] == bytes([GAME_START]):
+            stage, players = parse_game_start(raw_start[game_start_pos:])
+
+        duration = None
+        metadata = None
+        if raw_length:
+            metadata = read_metadata(f, raw_pos + raw_length)
+        if metadata is not None:
+            apply_metadata_players(players, metadata)
+            if 'lastFrame' in metadata:
+                duration = metadata['lastFrame'] - FIRST_FRAME_INDEX + 1
+
+        from_metadata = duration is not None
+        if duration is None:
+            duration = count_frames(f, raw_pos, raw_length, payload_sizes)
+            if duration is None:
+                raise RuntimeError("{} has no frames".format(slp_file))
+
+    return ReplayInfo(duration, players, stage, from_metadata)
@@ -0,0 +1,169 @@
+import os, json, time, uuid, threading, traceback, http.server
+import renderprogress
+from scheduler import format_seconds
+
+# Live status of a folder run, put together from the pipeline (how many jobs are in each state, time left) and
+# the games that are rendering right now (frames rendered out of the game's frames, render rate). Every interval
+# it's written to a JSON file and, if a port is given, served over HTTP on localhost, for dashboards to poll.
+# A one line summary is printed every print_interval seconds instead of each game printing its frame count.
+#
+# The status looks like:
+# {
+#     "time": 1558283254.1, "finished": false, "total": 200, "seconds_left": 3120.5, "fps": 241.3,
+#     "jobs": {"queued": 150, "rendering": 4, "rendered": 1, "muxing": 1, "done": 43, "failed": 1},
+#     "games": [{"slp_file": "...", "frames": 4120, "num_frames": 9630, "fps": 60.2}, ...]
+# }
+
+STATUS_INTERVAL = 1         # seconds between status file updates
+
+summarizing_count = 0
+summarizing_lock = threading.Lock()
+
+
+def summarizing():
+    """
+    True while a StatusReporter prints summaries, so games don't print their own progress
+    """
+    return summarizing_count > 0
+
+
+def write_status(path, status):
+    # Write then rename, so readers never see a half-written file
+    tmp_path = os.path.join(os.path.dirname(path), '.{}.tmp'.format(uuid.uuid4()))
+    with open(tmp_path, 'w') as f:
+        json.dump(status, f)
+    os.replace(tmp_path, path)
+
+
+def games_status():
+    games = []
+    for progress in renderprogress.live_progress():
+        if not progress.active:
+            continue
+        game = {
+            'slp_file': progress.slp_file,
+            'frames': progress.frames - progress.game_start_frames,
+            'num_frames': None,
+            # Until the game has rendered for a whole FPS window, its average so far
+            'fps': progress.fps() or progress.mean_fps(),
+        }
+        # The render thread may start the next game meanwhile
+        game_end_frames = progress.game_end_frames
+        if game_end_frames is not None:
+            game['num_frames'] = game_end_frames - progress.game_start_frames
+        games.append(game)
+    games.sort(key=lambda game: game['slp_file'] or '')
+    return games
+
+
+def summary_line(status):
+    jobs = status['jobs']
+    parts = ["{}/{} done".format(jobs['done'], status['total'])]
+    if jobs['failed']:
+        parts.append("{} failed".format(jobs['failed']))
+    parts.append("{} rendering".format(jobs['rendering']))
+    if jobs['muxing']:
+        parts.append("{} muxing".format(jobs['muxing']))
+    line = ', '.join(parts)
+    if status['games']:
+        line += " | {:.0f} FPS total".format(status['fps'])
+        # The game furthest behind, it's the one most likely to be stuck
+        behind = min(status['games'], key=lambda game: game['frames'] / (game['num_frames'] or 1))
+        if behind['num_frames']:
+            line += ", furthest behind {} {}/{}".format(os.path.basename(behind['slp_file'] or '?'), behind['frames'],
+                                                        behind['num_frames'])
+    if status['seconds_left'] is not None:
+        line += " | about {} left".format(format_seconds(max(status['seconds_left'], 0)))
+    return line
+
+
+class StatusHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps(self.server.reporter.status).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Dashboards poll often, don't fill the terminal with requests
+        pass
+
+
+class StatusReporter:
+    def __init__(self, pipeline, status_file=None, port=None, print_interval=None):
+        """
+        pipeline is the scheduler.Pipeline of the run. status_file and port can be None to not write or serve the
+        status, and print_interval None to not print summaries
+        """
+        self.pipeline = pipeline
+        self.status_file = status_file
+        self.port = port
+        self.print_interval = print_interval
+        self.status = self.make_status()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.server = None
+        self.write_failed = False
+
+    def __enter__(self):
+        global summarizing_count
+        if self.port:
+            self.server = http.server.ThreadingHTTPServer(('127.0.0.1', self.port), StatusHandler)
+            self.server.daemon_threads = True
+            self.server.reporter = self
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            print("Serving status on http://127.0.0.1:{}/".format(self.port))
+        if self.print_interval:
+            with summarizing_lock:
+                summarizing_count += 1
+        self.thread = threading.Thread(target=self.report, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, type, value, tb):
+        global summarizing_count
+        self.stopping.set()
+        self.thread.join()
+        self.update(finished=True)
+        if self.print_interval:
+            with summarizing_lock:
+                summarizing_count -= 1
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        # Re-raise any exception that occurred in the with block
+        if tb is not None:
+            return False
+
+    def make_status(self, finished=False):
+        status = dict(self.pipeline.status(), time=time.time(), finished=finished, games=games_status())
+        status['fps'] = sum(game['fps'] or 0 for game in status['games'])
+        return status
+
+    def update(self, finished=False):
+        self.status = self.make_status(finished)
+        if self.status_file is not None:
+            try:
+                write_status(self.status_file, self.status)
+            except OSError as e:
+                # Once is enough, it's tried again every second
+                if not self.write_failed:
+                    print("Warning: Couldn't write {}: {}".format(self.status_file, e))
+                    self.write_failed = True
+
+    def report(self):
+        last_print = time.perf_counter()
+        while not self.stopping.wait(STATUS_INTERVAL):
+            try:
+                self.update()
+            except Exception:
+                # Keep reporting, the next update may work
+                print("Warning: Updating the status failed")
+                traceback.print_exc()
+                continue
+            now = time.perf_counter()
+            if self.print_interval and now - last_print >= self.print_interval:
+                print(summary_line(self.status))
+                last_print = now
@@ -0,0 +1,143 @@
+import os, json, time, threading, contextlib
+
+# Per-job performance metrics, written as one JSON object per line, plus a summary at the end of a run.
+# Code anywhere in a job (Dolphin setup, rendering, muxing) records into the metrics of the job the current thread
+# is working on, so nothing has to be passed down just for measuring. Outside a job, recording does nothing.
+
+FPS_WARNING = 58            # Dolphin skips frames noticeably below this
+NUM_SLOWEST = 5
+
+local = threading.local()
+
+
+def current():
+    return getattr(local, 'metrics', None)
+
+
+@contextlib.contextmanager
+def job_context(metrics):
+    """
+    Record into metrics (a dict) from this thread while in the with block
+    """
+    previous = current()
+    local.metrics = metrics
+    try:
+        yield
+    finally:
+        local.metrics = previous
+
+
+def record(name, value):
+    metrics = current()
+    if metrics is not None:
+        metrics[name] = value
+
+
+@contextlib.contextmanager
+def phase(name):
+    """
+    Time the with block, recorded as <name>_seconds. Repeated phases add up
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics = current()
+        if metrics is not None:
+            key = name + '_seconds'
+            metrics[key] = metrics.get(key, 0) + time.perf_counter() - start
+
+
+class Telemetry:
+    def __init__(self, metrics_file, fps=60):
+        self.metrics_file = metrics_file
+        self.fps = fps
+        self.lock = threading.Lock()
+        self.jobs = []
+        self.start_time = None
+        self.f = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.metrics_file), exist_ok=True)
+        self.f = open(self.metrics_file, 'a')
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, type, value, tb):
+        summary = self.summary()
+        self.write(summary)
+        self.f.close()
+        self.print_summary(summary)
+        # Re-raise any exception that occurred in the with block
+        if tb is not None:
+            return False
+
+    def write(self, obj):
+        with self.lock:
+            self.f.write(json.dumps(obj) + '\n')
+            self.f.flush()
+
+    def start_job(self, job):
+        metrics = {
+            'type': 'job',
+            'slp_file': job.slp_file,
+            'out_file': job.out_file,
+            'frames': job.duration,
+            'start': time.time(),
+        }
+        # The replay is scanned before its job starts, when the folder is indexed
+        if job.parse_seconds is not None:
+            metrics['parse_seconds'] = job.parse_seconds
+        return metrics
+
+    def finish_job(self, metrics, ok, error=None):
+        metrics['ok'] = ok
+        metrics['error'] = error
+        metrics['wall_seconds'] = time.time() - metrics['start']
+        with self.lock:
+            self.jobs.append(metrics)
+        self.write(metrics)
+
+    def record_combine(self, group, seconds, out_file):
+        self.write({
+            'type': 'combine',
+            'group': group,
+            'combine_seconds': seconds,
+            'output_bytes': os.path.getsize(out_file) if os.path.exists(out_file) else None,
+        })
+
+    def summary(self):
+        wall_seconds = time.perf_counter() - self.start_time
+        with self.lock:
+            jobs = list(self.jobs)
+        done = [m for m in jobs if m['ok']]
+        game_seconds = sum(m['frames'] or 0 for m in done) / self.fps
+        slowest = sorted(jobs, key=lambda m: m['wall_seconds'], reverse=True)[:NUM_SLOWEST]
+        low_fps = [m for m in done if m.get('fps_mean') is not None and m['fps_mean'] < FPS_WARNING]
+        return {
+            'type': 'run',
+            'wall_seconds': wall_seconds,
+            'jobs': len(jobs),
+            'failed': len(jobs) - len(done),
+            'game_seconds': game_seconds,
+            # game-seconds rendered per wall-second
+            'throughput': game_seconds / wall_seconds if wall_seconds > 0 else None,
+            'output_bytes': sum(m.get('output_bytes') or 0 for m in done),
+            'slowest': [{'slp_file': m['slp_file'], 'wall_seconds': m['wall_seconds']} for m in slowest],
+            'low_fps': [{'slp_file': m['slp_file'], 'fps_mean': m['fps_mean'], 'fps_min': m.get('fps_min')}
+                        for m in low_fps],
+        }
+
+    def print_summary(self, summary):
+        if summary['jobs'] == 0:
+            return
+        print("Recorded {} games ({} failed) in {:.0f}s: {:.1f} minutes of gameplay, {:.2f} game-seconds per second".format(
+            summary['jobs'], summary['failed'], summary['wall_seconds'], summary['game_seconds'] / 60,
+            summary['throughput'] or 0))
+        print("Slowest games:")
+        for m in summary['slowest']:
+            print("  {:.0f}s {}".format(m['wall_seconds'], m['slp_file']))
+        for m in summary['low_fps']:
+            print("WARNING: {} rendered at {:.1f} FPS on average (below {}), the video may skip frames".format(
+                m['slp_file'], m['fps_mean'], FPS_WARNING))
+        print("Metrics written to {}".format(self.metrics_file))
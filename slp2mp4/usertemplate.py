@@ -0,0 +1,83 @@
+import os, sys, shutil, uuid
+from dolphinrunner import DolphinRunner
+
+# A copy of the playback Dolphin's User dir with our settings already applied, made once per run.
+# Each job gets its own User dir cloned from it:
+#   - directories Dolphin only reads (texture packs, game settings, ...) are symlinked to the template
+#   - directories Dolphin writes to (config, memory cards, shader cache, ...) get their own copy of each file,
+#     as a reflink where the filesystem supports it so it costs no extra space until written
+#   - Dump and Logs start out empty
+# Writable files are never shared between jobs: Dolphin rewrites its config on exit and appends to its shader
+# caches, and would corrupt the template (through a hardlink) or another running Dolphin (through a symlink).
+
+COPY_DIRS = {'Config', 'Cache', 'Shaders', 'GC', 'Wii', 'StateSaves', 'ScreenShots'}
+EMPTY_DIRS = {'Dump', 'Logs'}
+
+FICLONE = 0x40049409
+
+
+def reflink_or_copy(src, dst):
+    """
+    Copy src to dst, sharing the data blocks (copy-on-write) if the filesystem can, e.g. btrfs or XFS
+    """
+    if sys.platform.startswith('linux'):
+        import fcntl
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            shutil.copystat(src, dst)
+            return dst
+        except OSError:
+            pass
+    return shutil.copy2(src, dst)
+
+
+class UserTemplate:
+    def __init__(self, conf, base_user_dir, working_dir):
+        # Named like a job's User dir so clean() removes it if a run is killed
+        self.runner = DolphinRunner(conf, base_user_dir, working_dir, 'template-{}'.format(uuid.uuid4()))
+        self.user_dir = self.runner.user_dir
+        self.can_symlink = sys.platform != 'win32'
+
+    def __enter__(self):
+        self.runner.__enter__()
+        self.runner.keep_user_dir = True
+        self.runner.prep_dolphin_settings()
+        self.runner.prep_user_dir()
+        return self
+
+    def __exit__(self, type, value, tb):
+        shutil.rmtree(self.user_dir, ignore_errors=True)
+        # Re-raise any exception that occurred in the with block
+        if tb is not None:
+            return False
+
+    def link(self, src, dst):
+        if self.can_symlink:
+            try:
+                os.symlink(src, dst, target_is_directory=os.path.isdir(src))
+                return
+            except OSError:
+                # e.g. no permission to create symlinks
+                self.can_symlink = False
+        if os.path.isdir(src):
+            shutil.copytree(src, dst)
+        else:
+            shutil.copy2(src, dst)
+
+    def clone(self, user_dir):
+        """
+        Create a User dir for a job at user_dir
+        """
+        os.makedirs(user_dir)
+        for entry in os.scandir(self.user_dir):
+            dst = os.path.join(user_dir, entry.name)
+            if entry.name in EMPTY_DIRS:
+                os.makedirs(dst)
+            elif entry.name in COPY_DIRS or not entry.is_dir():
+                if entry.is_dir():
+                    shutil.copytree(entry.path, dst, copy_function=reflink_or_copy)
+                else:
+                    reflink_or_copy(entry.path, dst)
+            else:
+                self.link(entry.path, dst)
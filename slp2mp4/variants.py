@@ -0,0 +1,72 @@
+import os, hashlib
+
+# Extra encodes of every video at lower resolutions or bitrates, e.g. 720p and 480p copies for quick review next to
+# the full resolution archive. Dolphin renders each game once, at 'resolution', and ffmpeg scales and encodes the
+# variants from the same dump while it muxes the main video, decoding the dump once for all of them.
+# A variant of Game_1.mp4 named 720p is Game_1.720p.mp4, next to it.
+
+RESOLUTION_HEIGHT = {'480p': 480, '720p': 720, '1080p': 1080, '1440p': 1440, '2160p': 2160}
+DEFAULT_BITRATE_KBPS = {'480p': 2500, '720p': 5000, '1080p': 8000, '1440p': 16000, '2160p': 35000}
+
+
+class Variant:
+    def __init__(self, name, resolution, bitrate_kbps):
+        self.name = name
+        self.resolution = resolution
+        self.height = RESOLUTION_HEIGHT[resolution]
+        self.bitrate_kbps = bitrate_kbps
+
+    def out_file(self, main_file):
+        stem, ext = os.path.splitext(main_file)
+        return '{}.{}{}'.format(stem, self.name, ext)
+
+    def cache_key(self, main_key):
+        return hashlib.sha1('{}:{}:{}:{}'.format(main_key, self.name, self.height, self.bitrate_kbps).encode()).hexdigest()
+
+
+def split_out_files(files, variants):
+    """
+    Sort the mp4 files of a directory into the main files and each variant's files, {name: [file]}, keeping their order
+    A file is a variant's if Variant.out_file makes its name from another of the files. A main file that only ends
+    the same way, e.g. Game.720p.mp4 from Game.720p.slp, is still a main file
+    """
+    made_from = {}
+    for file in files:
+        for variant in variants:
+            made_from[variant.out_file(file)] = variant
+    main_files = []
+    variant_files = {variant.name: [] for variant in variants}
+    for file in files:
+        variant = made_from.get(file)
+        if variant is None:
+            main_files.append(file)
+        else:
+            variant_files[variant.name].append(file)
+    return main_files, variant_files
+
+
+def parse(entries, resolution):
+    """
+    Make the Variants from the 'variants' config entries, [{"resolution": ..., "bitrateKbps": ..., "name": ...}]
+    Entries that can't be made from a render at resolution are left out with a warning
+    """
+    variants = []
+    names = set()
+    max_height = RESOLUTION_HEIGHT.get(resolution, RESOLUTION_HEIGHT['480p'])
+    for entry in entries:
+        variant_resolution = entry.get('resolution')
+        if variant_resolution not in RESOLUTION_HEIGHT:
+            print("Warning: Variant resolution {} is not valid, leaving it out".format(variant_resolution))
+            continue
+        if RESOLUTION_HEIGHT[variant_resolution] > max_height:
+            print("Warning: Variant resolution {} is above 'resolution' ({}), leaving it out".format(
+                variant_resolution, resolution))
+            continue
+        name = entry.get('name', variant_resolution)
+        if name in names:
+            print("Warning: There is more than one variant named {}, give them different 'name's".format(name))
+            continue
+        names.add(name)
+        variants.append(Variant(name, variant_resolution,
+                                entry.get('bitrateKbps', DEFAULT_BITRATE_KBPS[variant_resolution])))
+    return variants
@@ -0,0 +1,127 @@
+import os, sys, time, threading
+
+# The modules in slp2mp4 import each other by name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'slp2mp4'))
+
+from distqueue import DirQueue, Heartbeat
+
+WORKERS = ('box-a', 'box-b')
+
+
+def make_job(i):
+    return {'id': 'job{:03}'.format(i), 'slp_file': 'Game_{}.slp'.format(i), 'out_file': 'Game_{}.mp4'.format(i)}
+
+
+def make_queue(tmp_path, jobs):
+    queue = DirQueue(str(tmp_path)).__enter__()
+    for i in range(jobs):
+        queue.publish(make_job(i))
+    return queue
+
+
+def wait_for_new_mtime():
+    # Far enough apart that the filesystem's timestamps tell the touches apart
+    time.sleep(0.05)
+
+
+def test_claim_race_gives_each_job_to_one_worker(tmp_path):
+    queue = make_queue(tmp_path, 50)
+    claimed = {worker_id: [] for worker_id in WORKERS}
+    start = threading.Barrier(len(WORKERS))
+
+    def work(worker_id):
+        # Each worker has its own DirQueue, as on separate machines
+        worker_queue = DirQueue(str(tmp_path))
+        start.wait()
+        while True:
+            lease = worker_queue.claim(worker_id)
+            if lease is None:
+                return
+            claimed[worker_id].append(lease.job['id'])
+
+    threads = [threading.Thread(target=work, args=(worker_id,)) for worker_id in WORKERS]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    all_claimed = claimed['box-a'] + claimed['box-b']
+    assert sorted(all_claimed) == [make_job(i)['id'] for i in range(50)]
+    assert queue.list('queued') == []
+    assert len(queue.list('leased')) == 50
+
+
+def test_heartbeat_keeps_the_lease(tmp_path):
+    queue = make_queue(tmp_path, 1)
+    lease = DirQueue(str(tmp_path)).claim('box-a')
+    assert queue.check_leases(0.2, 3) == ([('job000', 'box-a')], [])
+
+    for _ in range(5):
+        wait_for_new_mtime()
+        assert lease.heartbeat()
+        assert queue.check_leases(0.2, 3) == ([], [])
+
+    with Heartbeat(lease, 0.02):
+        time.sleep(0.3)
+        assert queue.check_leases(0.2, 3) == ([], [])
+    assert not lease.lost
+    assert queue.list('leased') == ['job000@box-a.json']
+
+
+def test_expired_lease_is_requeued_then_failed(tmp_path):
+    queue = make_queue(tmp_path, 1)
+    workers = [DirQueue(str(tmp_path)) for _ in WORKERS]
+
+    # box-a stops heartbeating, so the job goes back in the queue for box-b
+    lease_a = workers[0].claim('box-a')
+    assert queue.check_leases(0.1, 2) == ([('job000', 'box-a')], [])
+    time.sleep(0.15)
+    new_leases, expired = queue.check_leases(0.1, 2)
+    assert new_leases == []
+    assert [(job['id'], job['attempts']) for job in expired] == [('job000', 1)]
+    assert queue.list('queued') == ['job000.json']
+    assert not lease_a.heartbeat()
+
+    # box-b stops too, and that's max_attempts
+    lease_b = workers[1].claim('box-b')
+    assert lease_b.job['attempts'] == 1
+    assert queue.check_leases(0.1, 2) == ([('job000', 'box-b')], [])
+    time.sleep(0.15)
+    _, expired = queue.check_leases(0.1, 2)
+    assert [(job['id'], job['attempts'], job['ok']) for job in expired] == [('job000', 2, False)]
+    assert queue.list('queued') == []
+    assert queue.list('failed') == ['job000.json']
+    assert workers[0].claim('box-a') is None
+
+
+def test_late_finish_after_take_back(tmp_path):
+    queue = make_queue(tmp_path, 1)
+    lease = DirQueue(str(tmp_path)).claim('box-a')
+    queue.take_back(lease.path, 3)
+
+    assert not lease.finish(True, {'recorded': True})
+    assert lease.lost
+    assert queue.list('done') == []
+    assert queue.list('queued') == ['job000.json']
+
+    # Whoever claims it next can still finish it
+    lease = DirQueue(str(tmp_path)).claim('box-b')
+    assert lease.finish(True, {'recorded': True})
+
+
+def test_collect(tmp_path):
+    queue = make_queue(tmp_path, 3)
+    workers = [DirQueue(str(tmp_path)) for _ in WORKERS]
+    assert workers[0].claim('box-a').finish(True, {'recorded': True})
+    assert workers[1].claim('box-b').finish(False, {'error': 'Dolphin crashed'})
+    remaining = workers[0].claim('box-a')
+
+    results = sorted(queue.collect(), key=lambda job: job['id'])
+    assert [(job['id'], job['ok']) for job in results] == [('job000', True), ('job001', False)]
+    assert results[0]['recorded'] is True
+    assert results[1]['error'] == 'Dolphin crashed'
+    assert queue.list('done') == [] and queue.list('failed') == []
+    assert queue.collect() == []
+
+    assert remaining.finish(True, {'recorded': False})
+    assert [job['id'] for job in queue.collect()] == ['job002']